@@ -11,7 +11,8 @@ class Vineyard:
     ):
         self._parameters = list(parameters)
         self._persistence_diagrams = [
-            [[p[0], p[1]] for p in pd] for pd in persistence_diagrams
+            np.asarray(pd, dtype=float).reshape(-1, 2).tolist()
+            for pd in persistence_diagrams
         ]
 
     def parameter_indices(self):
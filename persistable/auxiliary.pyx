@@ -5,32 +5,181 @@
 
 import numpy as np
 cimport numpy as np
+from cython.parallel cimport prange
+from libc.math cimport INFINITY
 np.import_array()
 
 DTYPE = np.float64
 ctypedef np.float64_t DTYPE_t
 
 
-def lazy_intersection(np.ndarray[DTYPE_t, ndim=1] increasing, np.ndarray[DTYPE_t, ndim=1] increasing2, np.float64_t s0, np.float64_t k0) :
-    # find first occurence of s0 - (s0/k0) * increasing[i]) <= increasing2[i]
-    assert increasing.dtype == DTYPE and increasing2.dtype == DTYPE
+cdef inline Py_ssize_t _searchsorted_row(const DTYPE_t[:, :] sorted_rows, Py_ssize_t p, np.float64_t value, bint right) nogil :
+    # equivalent to np.searchsorted(sorted_rows[p], value, side="right" if right else "left")
+    cdef Py_ssize_t first = 0
+    cdef Py_ssize_t last = sorted_rows.shape[1]
+    cdef Py_ssize_t midpoint
+    while first < last :
+        midpoint = (first + last)//2
+        if sorted_rows[p, midpoint] < value or (right and sorted_rows[p, midpoint] == value) :
+            first = midpoint + 1
+        else:
+            last = midpoint
+    return first
+
+
+cdef inline np.float64_t _skew_core_distance(const DTYPE_t[:, :] increasing, const DTYPE_t[:, :] increasing2, Py_ssize_t p, np.float64_t s0, np.float64_t k0, np.float64_t max_k, int* not_enough_neighbors) nogil :
+    # lazy intersection of the line through (s0, 0) and (0, k0) with row p,
+    # followed by the evaluation of the core distance at the intersection
     cdef np.float64_t mu = s0/k0
-    cdef int first = 0
-    cdef int last = increasing.shape[0]-1
-    cdef int midpoint
-    cdef int res1
-    cdef int res2
+    cdef Py_ssize_t first = 0
+    cdef Py_ssize_t last = increasing.shape[1]-1
+    cdef Py_ssize_t midpoint
+    cdef np.float64_t s_at_previous
+    if s0 - mu * increasing[p, first] <= increasing2[p, first] :
+        return 0
+    elif s0 - mu * increasing[p, last] > increasing2[p, last] :
+        # the intersection finished at the last index
+        if increasing[p, last] < max_k:
+            not_enough_neighbors[0] = 1
+    else:
+        while first+1 < last :
+            midpoint = (first + last)//2
+            if s0 - mu * increasing[p, midpoint] <= increasing2[p, midpoint] :
+                last = midpoint
+            else:
+                first = midpoint
+    # the intersection is at the first index, as happens when the row has a
+    # single column
+    if last == 0:
+        return 0
+    s_at_previous = s0 - mu * increasing[p, last - 1]
+    if s_at_previous <= increasing2[p, last]:
+        return s_at_previous
+    else:
+        return increasing2[p, last]
+
+
+cdef inline np.float64_t _horizontal_core_distance(const DTYPE_t[:, :] increasing, const DTYPE_t[:, :] increasing2, Py_ssize_t p, np.float64_t k0) nogil :
+    cdef Py_ssize_t idx = _searchsorted_row(increasing, p, k0, False)
+    if idx == increasing2.shape[1]:
+        idx -= 1
+    return increasing2[p, idx]
+
+
+def lazy_intersections(const DTYPE_t[:, :] increasing, const DTYPE_t[:, :] increasing2, np.float64_t s0, np.float64_t k0, np.float64_t max_k, int n_threads=1) :
+    # finds, for each row p, the first index i such that
+    # s0 - (s0/k0) * increasing[p, i] <= increasing2[p, i], and evaluates the
+    # core distance of the row there, returning the core distances together
+    # with a flag indicating whether any row does not have enough neighbors;
+    # the rows are split among n_threads threads
+    cdef Py_ssize_t n = increasing.shape[0]
+    cdef Py_ssize_t p
+    cdef int not_enough_neighbors = 0
+    cdef int[::1] not_enough_neighbors_rows = np.zeros(n, dtype=np.intc)
+    core_distances = np.zeros(n, dtype=DTYPE)
+    cdef DTYPE_t[::1] core_distances_view = core_distances
     with nogil:
-        if s0 - mu * increasing[first] <= increasing2[first] :
-            res1, res2 = first, False
-        elif s0 - mu * increasing[last] > increasing2[last] :
-            res1, res2 = last, True
-        else:
-            while first+1 < last :
-                midpoint = (first + last)//2
-                if s0 - mu * increasing[midpoint] <= increasing2[midpoint] :
-                    last = midpoint
+        for p in prange(n, schedule="static", num_threads=n_threads):
+            core_distances_view[p] = _skew_core_distance(
+                increasing, increasing2, p, s0, k0, max_k, &not_enough_neighbors_rows[p]
+            )
+        for p in range(n):
+            not_enough_neighbors |= not_enough_neighbors_rows[p]
+    return core_distances, bool(not_enough_neighbors)
+
+
+def searchsorted_rows(const DTYPE_t[:, :] sorted_rows, np.float64_t value, side="left", int n_threads=1) :
+    # equivalent to calling np.searchsorted(sorted_rows[p], value, side=side)
+    # for every row p, but in a single call, with the rows split among
+    # n_threads threads
+    cdef bint right = side == "right"
+    cdef Py_ssize_t n = sorted_rows.shape[0]
+    cdef Py_ssize_t p
+    indices = np.empty(n, dtype=np.intp)
+    cdef np.intp_t[::1] indices_view = indices
+    with nogil:
+        for p in prange(n, schedule="static", num_threads=n_threads):
+            indices_view[p] = _searchsorted_row(sorted_rows, p, value, right)
+    return indices
+
+
+def core_distances_of_lines(const DTYPE_t[:, :] increasing, const DTYPE_t[:, :] increasing2, const DTYPE_t[:] s0s, const DTYPE_t[:] k0s, const DTYPE_t[:] max_ks, int n_threads=1) :
+    # core distances of every row with respect to every line, where a line is
+    # given by its intercepts (s0s[l], k0s[l]) and is horizontal if s0s[l] is
+    # infinite; each row is traversed once for all lines, so that it is only
+    # loaded into cache once, and the rows are split among n_threads threads.
+    # Also returns, for each line, whether any row does not have enough
+    # neighbors.
+    cdef Py_ssize_t n = increasing.shape[0]
+    cdef Py_ssize_t n_lines = s0s.shape[0]
+    cdef Py_ssize_t p
+    cdef Py_ssize_t l
+    cdef int[:, ::1] not_enough_neighbors_rows = np.zeros((n, n_lines), dtype=np.intc)
+    core_distances = np.zeros((n, n_lines), dtype=DTYPE)
+    cdef DTYPE_t[:, ::1] core_distances_view = core_distances
+    not_enough_neighbors = np.zeros(n_lines, dtype=bool)
+    with nogil:
+        for p in prange(n, schedule="static", num_threads=n_threads):
+            for l in range(n_lines):
+                if s0s[l] == INFINITY:
+                    core_distances_view[p, l] = _horizontal_core_distance(
+                        increasing, increasing2, p, k0s[l]
+                    )
                 else:
-                    first = midpoint
-            res1, res2 = last, False
-    return res1, res2
+                    core_distances_view[p, l] = _skew_core_distance(
+                        increasing, increasing2, p, s0s[l], k0s[l], max_ks[l],
+                        &not_enough_neighbors_rows[p, l]
+                    )
+    not_enough_neighbors[:] = np.any(not_enough_neighbors_rows, axis=0)
+    return core_distances, not_enough_neighbors
+
+
+cdef inline Py_ssize_t _find_root(np.intp_t[::1] parent, Py_ssize_t x) nogil :
+    # find with path halving
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def kruskal(Py_ssize_t n, const np.intp_t[:] sources, const np.intp_t[:] targets, const DTYPE_t[:] weights, np.intp_t[::1] parent=None, np.uint8_t[::1] rank=None) :
+    # minimum spanning forest of the graph on n vertices with the given edges,
+    # which must be sorted by weight; returns the edges of the forest as an
+    # array of merges and an array of merges heights, both sorted by height.
+    # The union-find structure can be given as the arrays parent and rank, in
+    # which case it is updated in place, so that the edges of a graph can be
+    # given in several batches, as long as the weights of each batch are not
+    # smaller than the ones of the previous batches.
+    cdef Py_ssize_t n_edges = sources.shape[0]
+    cdef Py_ssize_t e
+    cdef Py_ssize_t root1
+    cdef Py_ssize_t root2
+    cdef Py_ssize_t n_merges = 0
+    cdef Py_ssize_t max_merges = min(max(n - 1, 0), n_edges)
+    if parent is None or rank is None:
+        parent = np.arange(n, dtype=np.intp)
+        rank = np.zeros(n, dtype=np.uint8)
+    merges = np.zeros((max_merges, 2), dtype=np.intp)
+    merges_heights = np.zeros(max_merges, dtype=DTYPE)
+    cdef np.intp_t[:, ::1] merges_view = merges
+    cdef DTYPE_t[::1] merges_heights_view = merges_heights
+    with nogil:
+        for e in range(n_edges):
+            if n_merges == max_merges:
+                break
+            root1 = _find_root(parent, sources[e])
+            root2 = _find_root(parent, targets[e])
+            if root1 == root2:
+                continue
+            if rank[root1] < rank[root2]:
+                parent[root1] = root2
+            elif rank[root1] > rank[root2]:
+                parent[root2] = root1
+            else:
+                parent[root2] = root1
+                rank[root1] += 1
+            merges_view[n_merges, 0] = sources[e]
+            merges_view[n_merges, 1] = targets[e]
+            merges_heights_view[n_merges] = weights[e]
+            n_merges += 1
+    return merges[:n_merges], merges_heights[:n_merges]
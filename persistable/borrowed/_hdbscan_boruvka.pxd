@@ -23,3 +23,5 @@ cdef class BoruvkaUnionFind (object):
     cpdef np.intp_t find(self, np.intp_t x) except -1
 
     cpdef np.ndarray[np.intp_t, ndim=1] components(self)
+
+    cpdef int reset(self) except -1
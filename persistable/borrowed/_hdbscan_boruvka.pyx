@@ -72,9 +72,16 @@ cimport dist_metrics as dist_metrics
 
 from joblib import Parallel, delayed
 
+from cython.parallel cimport prange, threadid
+
 
 cdef np.double_t INF = np.inf
 
+# Distance metrics that keep mutable state, namely a scratch buffer, in the
+# DistanceMetric object, and thus give wrong distances when used by several
+# threads at once
+_THREAD_UNSAFE_METRICS = (dist_metrics.MahalanobisDistance,)
+
 
 # Define the NodeData struct used in sklearn trees for faster
 # access to the node data internals in Cython.
@@ -160,6 +167,15 @@ cdef class BoruvkaUnionFind (object):
                                              self._rank_arr.data))
         self.is_component = np.ones(size, dtype=bool)
 
+    cpdef int reset(self) except -1:
+        """Put every element back in its own component"""
+        cdef np.intp_t x
+        for x in range(self._parent.shape[0]):
+            self._parent[x] = x
+            self._rank[x] = 0
+        self.is_component[:] = True
+        return 0
+
     cpdef int union_(self, np.intp_t x, np.intp_t y) except -1:
         """Union together elements x and y"""
         cdef np.intp_t x_root = self.find(x)
@@ -208,7 +224,6 @@ cdef class KDTreeBoruvkaAlgorithm (object):
 
     cdef object tree
     cdef dist_metrics.DistanceMetric dist
-    cdef np.ndarray _data
     cdef np.double_t[:, ::1] _raw_data
     cdef np.double_t[:, :, ::1] node_bounds
     cdef np.int8_t approx_min_span_tree
@@ -229,7 +244,8 @@ cdef class KDTreeBoruvkaAlgorithm (object):
     cdef BoruvkaUnionFind component_union_find
     cdef np.ndarray edges
     cdef np.intp_t num_edges
-    cdef np.ndarray dendrogram 
+    cdef np.ndarray dendrogram
+    cdef bint needs_reset
 
     cdef np.intp_t *component_of_point_ptr
     cdef np.intp_t *component_of_node_ptr
@@ -249,14 +265,22 @@ cdef class KDTreeBoruvkaAlgorithm (object):
     cdef np.ndarray candidate_neighbor_arr
     cdef np.ndarray candidate_distance_arr
 
+    cdef np.intp_t num_threads
+    cdef np.intp_t split_depth
+    cdef np.ndarray thread_candidate_distance_arr
+    cdef np.ndarray thread_candidate_neighbor_arr
+    cdef np.ndarray thread_candidate_point_arr
+    cdef np.double_t[:, ::1] thread_candidate_distance
+    cdef np.intp_t[:, ::1] thread_candidate_neighbor
+    cdef np.intp_t[:, ::1] thread_candidate_point
+
     ####
     cdef const np.int_t[:, ::1] nn
     ####
 
-    def __init__(self, tree, core_distance, const np.int_t[:, ::1] nn, metric='euclidean', approx_min_span_tree=False, **kwargs):
+    def __init__(self, tree, core_distance, const np.int_t[:, ::1] nn, metric='euclidean', approx_min_span_tree=False, n_jobs=1, **kwargs):
 
         self.tree = tree
-        self._data = np.array(self.tree.data)
         self._raw_data = self.tree.data
         self.node_bounds = self.tree.node_bounds
         self.approx_min_span_tree = approx_min_span_tree
@@ -266,7 +290,8 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         self.num_nodes = self.tree.node_data.shape[0]
 
         ####
-        self.core_distance_arr = np.asarray(core_distance,dtype=np.double).copy()
+        # the core distances are copied into this buffer by reset
+        self.core_distance_arr = np.empty(self.num_points, dtype=np.double)
         self.core_distance = (<np.double_t[:self.num_points:1]> (
             <np.double_t *> self.core_distance_arr.data))
 
@@ -306,6 +331,26 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         self.candidate_distance = (<np.double_t[:self.num_points:1]> (
             <np.double_t *> self.candidate_distance_arr.data))
 
+        # With several threads, the query tree is split into the subtrees
+        # rooted at depth split_depth, which are traversed concurrently, each
+        # thread keeping its own candidates. We want a few subtrees per thread.
+        self.num_threads = max(1, n_jobs)
+        if isinstance(self.dist, _THREAD_UNSAFE_METRICS):
+            self.num_threads = 1
+        self.split_depth = 0
+        while (2 ** self.split_depth < 4 * self.num_threads and
+               2 ** (self.split_depth + 2) - 1 <= self.num_nodes):
+            self.split_depth += 1
+        self.thread_candidate_distance_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.double)
+        self.thread_candidate_neighbor_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.intp)
+        self.thread_candidate_point_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.intp)
+        self.thread_candidate_distance = self.thread_candidate_distance_arr
+        self.thread_candidate_neighbor = self.thread_candidate_neighbor_arr
+        self.thread_candidate_point = self.thread_candidate_point_arr
+
         # self._centroid_distances_arr = self.dist.pairwise(
         #     self.tree.node_bounds[0])
         # self.centroid_distances = (
@@ -314,9 +359,6 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         #                       <np.double_t *>
         #                       self._centroid_distances_arr.data))
 
-        self._initialize_components()
-        self._compute_bounds()
-
         # Set up fast pointer access to arrays
         self.component_of_point_ptr = <np.intp_t *> &self.component_of_point[0]
         self.component_of_node_ptr = <np.intp_t *> &self.component_of_node[0]
@@ -327,7 +369,52 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         self.core_distance_ptr = <np.double_t *> &self.core_distance[0]
         self.bounds_ptr = <np.double_t *> &self.bounds[0]
 
-    cdef _compute_bounds(self):
+        self.needs_reset = True
+        if core_distance is not None:
+            self.reset(core_distance)
+
+    def reset(self, core_distance, initial_edges=None):
+        """Prepare for computing the minimum spanning tree with respect to
+        new core distances, reusing the tree, the work arrays, and the
+        static node bounds computed at construction.
+
+        initial_edges, if given, is an array of shape (num_edges, 3) whose
+        rows (source, sink, distance) are edges of a forest known to be
+        contained in a minimum spanning tree for the new core distances.
+        These edges are added to the spanning tree, so that only the
+        remaining edges have to be found by traversing the tree."""
+
+        cdef np.intp_t e
+        cdef np.intp_t source
+        cdef np.intp_t sink
+        cdef np.double_t[:, ::1] initial_edges_view
+
+        self.core_distance_arr[:] = core_distance
+        self.components = np.arange(self.num_points)
+        self.component_union_find.reset()
+        self.num_edges = 0
+
+        self._initialize_components()
+        if initial_edges is not None and len(initial_edges) > 0:
+            initial_edges_view = np.ascontiguousarray(initial_edges,
+                                                      dtype=np.double)
+            for e in range(initial_edges_view.shape[0]):
+                source = <np.intp_t> initial_edges_view[e, 0]
+                sink = <np.intp_t> initial_edges_view[e, 1]
+                if (self.component_union_find.find(source) ==
+                        self.component_union_find.find(sink)):
+                    continue
+                self.edges[self.num_edges, 0] = source
+                self.edges[self.num_edges, 1] = sink
+                self.edges[self.num_edges, 2] = initial_edges_view[e, 2]
+                self.num_edges += 1
+                self.component_union_find.union_(source, sink)
+            self._compute_bounds(use_nn=False)
+        else:
+            self._compute_bounds()
+        self.needs_reset = False
+
+    cdef _compute_bounds(self, bint use_nn=True):
         """Initialize core distances"""
 
         cdef np.intp_t n
@@ -346,17 +433,20 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         # get every point due to core_distance/mutual reachability distance
         # issues, but we'll get quite a few, and they are the hard ones to
         # get, so fill in any we can and then run update components.
-        for n, nns in enumerate(self.nn):
-            ####
-            for m in nns:
-                if n == m:
-                    break
-            ####
-                if self.core_distance[m] <= self.core_distance[n]:
-                    self.candidate_point[n] = n
-                    self.candidate_neighbor[n] = m
-                    self.candidate_distance[n] = self.core_distance[n]
-                    break
+        # This is only valid if every point is its own component, so it is
+        # skipped if the spanning tree was seeded with some edges.
+        if use_nn:
+            for n, nns in enumerate(self.nn):
+                ####
+                for m in nns:
+                    if n == m:
+                        break
+                ####
+                    if self.core_distance[m] <= self.core_distance[n]:
+                        self.candidate_point[n] = n
+                        self.candidate_neighbor[n] = m
+                        self.candidate_distance[n] = self.core_distance[n]
+                        break
 
         self.update_components()
 
@@ -444,7 +534,7 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         # Have done that we then go through and set the component
         # of each node, as this provides fast pruning in later
         # tree traversals.
-        for n in range(self.tree.data.shape[0]):
+        for n in range(self.num_points):
             self.component_of_point[n] = self.component_union_find.find(n)
 
         for n in range(self.tree.node_data.shape[0] - 1, -1, -1):
@@ -495,14 +585,20 @@ cdef class KDTreeBoruvkaAlgorithm (object):
         return self.components.shape[0]
 
     cdef int dual_tree_traversal(self, np.intp_t node1,
-                                 np.intp_t node2) nogil except -1:
+                                 np.intp_t node2,
+                                 np.double_t *candidate_distance_ptr,
+                                 np.intp_t *candidate_neighbor_ptr,
+                                 np.intp_t *candidate_point_ptr,
+                                 np.intp_t query_root) nogil except -1:
         """Perform a dual tree traversal, pruning wherever possible, to find
         the nearest neighbor not in the same component for each component.
         This is akin to a standard dual tree NN search, but we also prune
         whenever all points in query and reference nodes are in the same
-        component."""
+        component.
 
-        cdef np.intp_t[::1] point_indices1, point_indices2
+        The candidates found are stored in the given arrays, and bounds are
+        only propagated up to query_root, so that traversals of disjoint
+        query subtrees can run concurrently with their own candidate arrays."""
 
         cdef np.intp_t i
         cdef np.intp_t j
@@ -585,27 +681,22 @@ cdef class KDTreeBoruvkaAlgorithm (object):
             new_upper_bound = 0.0
             new_lower_bound = DBL_MAX
 
-            point_indices1 = self.idx_array[node1_info.idx_start:
-                                            node1_info.idx_end]
-            point_indices2 = self.idx_array[node2_info.idx_start:
-                                            node2_info.idx_end]
-
-            for i in range(point_indices1.shape[0]):
+            for i in range(node1_info.idx_start, node1_info.idx_end):
 
-                p = point_indices1[i]
+                p = self.idx_array[i]
                 component1 = self.component_of_point_ptr[p]
 
                 if (self.core_distance_ptr[p] >
-                        self.candidate_distance_ptr[component1]):
+                        candidate_distance_ptr[component1]):
                     continue
 
-                for j in range(point_indices2.shape[0]):
+                for j in range(node2_info.idx_start, node2_info.idx_end):
 
-                    q = point_indices2[j]
+                    q = self.idx_array[j]
                     component2 = self.component_of_point_ptr[q]
 
                     if (self.core_distance_ptr[q] >
-                            self.candidate_distance_ptr[component1]):
+                            candidate_distance_ptr[component1]):
                         continue
 
                     if component1 != component2:
@@ -619,15 +710,15 @@ cdef class KDTreeBoruvkaAlgorithm (object):
                         #               self.core_distance_ptr[q])
                         mr_dist = max(d, self.core_distance_ptr[p],
                                           self.core_distance_ptr[q])
-                        if mr_dist < self.candidate_distance_ptr[component1]:
-                            self.candidate_distance_ptr[component1] = mr_dist
-                            self.candidate_neighbor_ptr[component1] = q
-                            self.candidate_point_ptr[component1] = p
+                        if mr_dist < candidate_distance_ptr[component1]:
+                            candidate_distance_ptr[component1] = mr_dist
+                            candidate_neighbor_ptr[component1] = q
+                            candidate_point_ptr[component1] = p
 
                 new_upper_bound = max(new_upper_bound,
-                                      self.candidate_distance_ptr[component1])
+                                      candidate_distance_ptr[component1])
                 new_lower_bound = min(new_lower_bound,
-                                      self.candidate_distance_ptr[component1])
+                                      candidate_distance_ptr[component1])
 
             # Compute new bounds for the query node, and
             # then propagate the results of that computation
@@ -640,7 +731,7 @@ cdef class KDTreeBoruvkaAlgorithm (object):
                 self.bounds_ptr[node1] = new_bound
 
                 # Propagate bounds up the tree
-                while node1 > 0:
+                while node1 > query_root:
                     parent = (node1 - 1) // 2
                     left = 2 * parent + 1
                     right = 2 * parent + 2
@@ -686,11 +777,19 @@ cdef class KDTreeBoruvkaAlgorithm (object):
                                                self.num_features)
 
             if left_dist < right_dist:
-                self.dual_tree_traversal(node1, left)
-                self.dual_tree_traversal(node1, right)
+                self.dual_tree_traversal(node1, left, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(node1, right, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
             else:
-                self.dual_tree_traversal(node1, right)
-                self.dual_tree_traversal(node1, left)
+                self.dual_tree_traversal(node1, right, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(node1, left, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
 
         # Case 2b: The reference node is a leaf, or is smaller than
         #          the query node.
@@ -718,25 +817,90 @@ cdef class KDTreeBoruvkaAlgorithm (object):
                                                self.num_features)
 
             if left_dist < right_dist:
-                self.dual_tree_traversal(left, node2)
-                self.dual_tree_traversal(right, node2)
+                self.dual_tree_traversal(left, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(right, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
             else:
-                self.dual_tree_traversal(right, node2)
-                self.dual_tree_traversal(left, node2)
+                self.dual_tree_traversal(right, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(left, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+
+        return 0
+
+    cdef int find_candidates(self) except -1:
+        """For each component, find the nearest point not in the component.
+        With several threads, each subtree of the query tree rooted at depth
+        split_depth is traversed against the whole reference tree by one
+        thread, and the candidates found by the threads are then combined."""
+
+        cdef np.intp_t t
+        cdef np.intp_t c
+        cdef np.intp_t query_root
+        cdef np.intp_t first_root
+        cdef np.intp_t last_root
+        cdef int num_threads = self.num_threads
+
+        if self.num_threads == 1 or self.split_depth == 0:
+            self.dual_tree_traversal(0, 0, self.candidate_distance_ptr,
+                                     self.candidate_neighbor_ptr,
+                                     self.candidate_point_ptr, 0)
+            return 0
 
+        # every thread starts from the current candidates
+        self.thread_candidate_distance_arr[:] = self.candidate_distance_arr
+        self.thread_candidate_neighbor_arr[:] = self.candidate_neighbor_arr
+        self.thread_candidate_point_arr[:] = self.candidate_point_arr
+
+        first_root = 2 ** self.split_depth - 1
+        last_root = 2 ** (self.split_depth + 1) - 1
+        with nogil:
+            for query_root in prange(first_root, last_root,
+                                     num_threads=num_threads,
+                                     schedule='dynamic'):
+                t = threadid()
+                self.dual_tree_traversal(
+                    query_root, 0, &self.thread_candidate_distance[t, 0],
+                    &self.thread_candidate_neighbor[t, 0],
+                    &self.thread_candidate_point[t, 0], query_root)
+
+            for t in range(self.num_threads):
+                for c in range(self.num_points):
+                    if (self.thread_candidate_distance[t, c] <
+                            self.candidate_distance_ptr[c]):
+                        self.candidate_distance_ptr[c] = (
+                            self.thread_candidate_distance[t, c])
+                        self.candidate_neighbor_ptr[c] = (
+                            self.thread_candidate_neighbor[t, c])
+                        self.candidate_point_ptr[c] = (
+                            self.thread_candidate_point[t, c])
         return 0
 
-    def spanning_tree(self):
+    def spanning_tree(self, core_distance=None, initial_edges=None):
         """Compute the minimum spanning tree of the data held by
-        the tree passed in at construction"""
+        the tree passed in at construction, with respect to the given
+        core distances and initial edges (see reset), or the ones of
+        the last call to reset"""
+
+        if core_distance is not None:
+            self.reset(core_distance, initial_edges)
+        elif self.needs_reset:
+            raise ValueError(
+                "New core distances must be given before computing another spanning tree.")
+        self.needs_reset = True
 
         # cdef np.intp_t num_components
         # cdef np.intp_t num_nodes
 
-        cdef int num_components = self.tree.data.shape[0]
+        cdef int num_components = self.components.shape[0]
         cdef int num_nodes = self.tree.node_data.shape[0]
         while num_components > 1:
-            self.dual_tree_traversal(0, 0)
+            self.find_candidates()
             num_components = self.update_components()
 
         order = np.argsort(self.edges[:, 2], kind='mergesort')
@@ -751,7 +915,6 @@ cdef class BallTreeBoruvkaAlgorithm (object):
 
     cdef object tree
     cdef dist_metrics.DistanceMetric dist
-    cdef np.ndarray _data
     cdef np.double_t[:, ::1] _raw_data
     cdef np.int8_t approx_min_span_tree
     cdef np.intp_t num_points
@@ -771,7 +934,8 @@ cdef class BallTreeBoruvkaAlgorithm (object):
     cdef BoruvkaUnionFind component_union_find
     cdef np.ndarray edges
     cdef np.intp_t num_edges
-    cdef np.ndarray dendrogram 
+    cdef np.ndarray dendrogram
+    cdef bint needs_reset
 
     cdef np.intp_t *component_of_point_ptr
     cdef np.intp_t *component_of_node_ptr
@@ -791,13 +955,21 @@ cdef class BallTreeBoruvkaAlgorithm (object):
     cdef np.ndarray candidate_neighbor_arr
     cdef np.ndarray candidate_distance_arr
 
+    cdef np.intp_t num_threads
+    cdef np.intp_t split_depth
+    cdef np.ndarray thread_candidate_distance_arr
+    cdef np.ndarray thread_candidate_neighbor_arr
+    cdef np.ndarray thread_candidate_point_arr
+    cdef np.double_t[:, ::1] thread_candidate_distance
+    cdef np.intp_t[:, ::1] thread_candidate_neighbor
+    cdef np.intp_t[:, ::1] thread_candidate_point
+
     cdef const np.int_t[:, ::1] nn
 
     def __init__(self, tree, core_distance, const np.int_t[:,::1] nn, metric='euclidean', approx_min_span_tree=False,
-                 **kwargs):
+                 n_jobs=1, **kwargs):
 
         self.tree = tree
-        self._data = np.array(self.tree.data)
         self._raw_data = self.tree.data
         self.approx_min_span_tree = approx_min_span_tree
 
@@ -806,8 +978,8 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         self.num_nodes = self.tree.node_data.shape[0]
 
         ####
-        #self.core_distance_arr = np.asarray(core_distance,dtype=np.double).copy()
-        self.core_distance_arr = np.asarray(core_distance,dtype=np.double)
+        # the core distances are copied into this buffer by reset
+        self.core_distance_arr = np.empty(self.num_points, dtype=np.double)
         self.core_distance = (<np.double_t[:self.num_points:1]> (
             <np.double_t *> self.core_distance_arr.data))
 
@@ -846,6 +1018,26 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         self.candidate_distance = (<np.double_t[:self.num_points:1]> (
             <np.double_t *> self.candidate_distance_arr.data))
 
+        # With several threads, the query tree is split into the subtrees
+        # rooted at depth split_depth, which are traversed concurrently, each
+        # thread keeping its own candidates. We want a few subtrees per thread.
+        self.num_threads = max(1, n_jobs)
+        if isinstance(self.dist, _THREAD_UNSAFE_METRICS):
+            self.num_threads = 1
+        self.split_depth = 0
+        while (2 ** self.split_depth < 4 * self.num_threads and
+               2 ** (self.split_depth + 2) - 1 <= self.num_nodes):
+            self.split_depth += 1
+        self.thread_candidate_distance_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.double)
+        self.thread_candidate_neighbor_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.intp)
+        self.thread_candidate_point_arr = np.empty(
+            (self.num_threads, self.num_points), dtype=np.intp)
+        self.thread_candidate_distance = self.thread_candidate_distance_arr
+        self.thread_candidate_neighbor = self.thread_candidate_neighbor_arr
+        self.thread_candidate_point = self.thread_candidate_point_arr
+
         self._centroid_distances_arr = self.dist.pairwise(
             self.tree.node_bounds[0])
         self.centroid_distances = (
@@ -853,9 +1045,6 @@ cdef class BallTreeBoruvkaAlgorithm (object):
                          :self.num_nodes:1]> (
                              <np.double_t *> self._centroid_distances_arr.data))
 
-        self._initialize_components()
-        self._compute_bounds()
-
         # Set up fast pointer access to arrays
         self.component_of_point_ptr = <np.intp_t *> &self.component_of_point[0]
         self.component_of_node_ptr = <np.intp_t *> &self.component_of_node[0]
@@ -865,7 +1054,52 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         self.core_distance_ptr = <np.double_t *> &self.core_distance[0]
         self.bounds_ptr = <np.double_t *> &self.bounds[0]
 
-    cdef _compute_bounds(self):
+        self.needs_reset = True
+        if core_distance is not None:
+            self.reset(core_distance)
+
+    def reset(self, core_distance, initial_edges=None):
+        """Prepare for computing the minimum spanning tree with respect to
+        new core distances, reusing the tree, the work arrays, and the
+        static node bounds computed at construction.
+
+        initial_edges, if given, is an array of shape (num_edges, 3) whose
+        rows (source, sink, distance) are edges of a forest known to be
+        contained in a minimum spanning tree for the new core distances.
+        These edges are added to the spanning tree, so that only the
+        remaining edges have to be found by traversing the tree."""
+
+        cdef np.intp_t e
+        cdef np.intp_t source
+        cdef np.intp_t sink
+        cdef np.double_t[:, ::1] initial_edges_view
+
+        self.core_distance_arr[:] = core_distance
+        self.components = np.arange(self.num_points)
+        self.component_union_find.reset()
+        self.num_edges = 0
+
+        self._initialize_components()
+        if initial_edges is not None and len(initial_edges) > 0:
+            initial_edges_view = np.ascontiguousarray(initial_edges,
+                                                      dtype=np.double)
+            for e in range(initial_edges_view.shape[0]):
+                source = <np.intp_t> initial_edges_view[e, 0]
+                sink = <np.intp_t> initial_edges_view[e, 1]
+                if (self.component_union_find.find(source) ==
+                        self.component_union_find.find(sink)):
+                    continue
+                self.edges[self.num_edges, 0] = source
+                self.edges[self.num_edges, 1] = sink
+                self.edges[self.num_edges, 2] = initial_edges_view[e, 2]
+                self.num_edges += 1
+                self.component_union_find.union_(source, sink)
+            self._compute_bounds(use_nn=False)
+        else:
+            self._compute_bounds()
+        self.needs_reset = False
+
+    cdef _compute_bounds(self, bint use_nn=True):
         """Initialize core distances"""
 
         cdef np.intp_t n
@@ -877,17 +1111,20 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         # get every point due to core_distance/mutual reachability distance
         # issues, but we'll get quite a few, and they are the hard ones to get,
         # so fill in any we can and then run update components.
-        for n, nns in enumerate(self.nn):
-            ####
-            for m in nns:
-                if n == m:
-                    break
-            ####
-                if self.core_distance[m] <= self.core_distance[n]:
-                    self.candidate_point[n] = n
-                    self.candidate_neighbor[n] = m
-                    self.candidate_distance[n] = self.core_distance[n]
-                    break
+        # This is only valid if every point is its own component, so it is
+        # skipped if the spanning tree was seeded with some edges.
+        if use_nn:
+            for n, nns in enumerate(self.nn):
+                ####
+                for m in nns:
+                    if n == m:
+                        break
+                ####
+                    if self.core_distance[m] <= self.core_distance[n]:
+                        self.candidate_point[n] = n
+                        self.candidate_neighbor[n] = m
+                        self.candidate_distance[n] = self.core_distance[n]
+                        break
 
         self.update_components()
 
@@ -972,7 +1209,7 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         # Have done that we then go through and set the component
         # of each node, as this provides fast pruning in later
         # tree traversals.
-        for n in range(self.tree.data.shape[0]):
+        for n in range(self.num_points):
             self.component_of_point[n] = self.component_union_find.find(n)
 
         for n in range(self.tree.node_data.shape[0] - 1, -1, -1):
@@ -1022,14 +1259,20 @@ cdef class BallTreeBoruvkaAlgorithm (object):
         return self.components.shape[0]
 
     cdef int dual_tree_traversal(self, np.intp_t node1,
-                                 np.intp_t node2) nogil except -1:
+                                 np.intp_t node2,
+                                 np.double_t *candidate_distance_ptr,
+                                 np.intp_t *candidate_neighbor_ptr,
+                                 np.intp_t *candidate_point_ptr,
+                                 np.intp_t query_root) nogil except -1:
         """Perform a dual tree traversal, pruning wherever possible, to find
         the nearest neighbor not in the same component for each component.
         This is akin to a standard dual tree NN search, but we also prune
         whenever all points in query and reference nodes are in the same
-        component."""
+        component.
 
-        cdef np.intp_t[::1] point_indices1, point_indices2
+        The candidates found are stored in the given arrays, and bounds are
+        only propagated up to query_root, so that traversals of disjoint
+        query subtrees can run concurrently with their own candidate arrays."""
 
         cdef np.intp_t i
         cdef np.intp_t j
@@ -1111,26 +1354,21 @@ cdef class BallTreeBoruvkaAlgorithm (object):
             new_upper_bound = 0.0
             new_lower_bound = DBL_MAX
 
-            point_indices1 = self.idx_array[node1_info.idx_start:
-                                            node1_info.idx_end]
-            point_indices2 = self.idx_array[node2_info.idx_start:
-                                            node2_info.idx_end]
-
-            for i in range(point_indices1.shape[0]):
+            for i in range(node1_info.idx_start, node1_info.idx_end):
 
-                p = point_indices1[i]
+                p = self.idx_array[i]
                 component1 = self.component_of_point_ptr[p]
 
-                if self.core_distance_ptr[p] > self.candidate_distance_ptr[
+                if self.core_distance_ptr[p] > candidate_distance_ptr[
                         component1]:
                     continue
 
-                for j in range(point_indices2.shape[0]):
+                for j in range(node2_info.idx_start, node2_info.idx_end):
 
-                    q = point_indices2[j]
+                    q = self.idx_array[j]
                     component2 = self.component_of_point_ptr[q]
 
-                    if self.core_distance_ptr[q] > self.candidate_distance_ptr[
+                    if self.core_distance_ptr[q] > candidate_distance_ptr[
                             component1]:
                         continue
 
@@ -1143,15 +1381,15 @@ cdef class BallTreeBoruvkaAlgorithm (object):
                         mr_dist = max(d, self.core_distance_ptr[p],
                                           self.core_distance_ptr[q])
 
-                        if mr_dist < self.candidate_distance_ptr[component1]:
-                            self.candidate_distance_ptr[component1] = mr_dist
-                            self.candidate_neighbor_ptr[component1] = q
-                            self.candidate_point_ptr[component1] = p
+                        if mr_dist < candidate_distance_ptr[component1]:
+                            candidate_distance_ptr[component1] = mr_dist
+                            candidate_neighbor_ptr[component1] = q
+                            candidate_point_ptr[component1] = p
 
                 new_upper_bound = max(new_upper_bound,
-                                      self.candidate_distance_ptr[component1])
+                                      candidate_distance_ptr[component1])
                 new_lower_bound = min(new_lower_bound,
-                                      self.candidate_distance_ptr[component1])
+                                      candidate_distance_ptr[component1])
 
             # Compute new bounds for the query node, and
             # then propagate the results of that computation
@@ -1163,7 +1401,7 @@ cdef class BallTreeBoruvkaAlgorithm (object):
                 self.bounds_ptr[node1] = new_bound
 
                 # Propagate bounds up the tree
-                while node1 > 0:
+                while node1 > query_root:
                     parent = (node1 - 1) // 2
                     left = 2 * parent + 1
                     right = 2 * parent + 2
@@ -1218,11 +1456,19 @@ cdef class BallTreeBoruvkaAlgorithm (object):
                                                 self.centroid_distances)
 
             if left_dist < right_dist:
-                self.dual_tree_traversal(node1, left)
-                self.dual_tree_traversal(node1, right)
+                self.dual_tree_traversal(node1, left, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(node1, right, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
             else:
-                self.dual_tree_traversal(node1, right)
-                self.dual_tree_traversal(node1, left)
+                self.dual_tree_traversal(node1, right, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(node1, left, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
 
         # Case 2b: The reference node is a leaf, or is smaller than
         #          the query node.
@@ -1250,23 +1496,88 @@ cdef class BallTreeBoruvkaAlgorithm (object):
                                                 self.centroid_distances)
 
             if left_dist < right_dist:
-                self.dual_tree_traversal(left, node2)
-                self.dual_tree_traversal(right, node2)
+                self.dual_tree_traversal(left, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(right, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
             else:
-                self.dual_tree_traversal(right, node2)
-                self.dual_tree_traversal(left, node2)
+                self.dual_tree_traversal(right, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
+                self.dual_tree_traversal(left, node2, candidate_distance_ptr,
+                                         candidate_neighbor_ptr,
+                                         candidate_point_ptr, query_root)
 
         return 0
 
-    cpdef spanning_tree(self):
-        """Compute the minimum spanning tree of the data held by
-        the tree passed in at construction"""
+    cdef int find_candidates(self) except -1:
+        """For each component, find the nearest point not in the component.
+        With several threads, each subtree of the query tree rooted at depth
+        split_depth is traversed against the whole reference tree by one
+        thread, and the candidates found by the threads are then combined."""
+
+        cdef np.intp_t t
+        cdef np.intp_t c
+        cdef np.intp_t query_root
+        cdef np.intp_t first_root
+        cdef np.intp_t last_root
+        cdef int num_threads = self.num_threads
+
+        if self.num_threads == 1 or self.split_depth == 0:
+            self.dual_tree_traversal(0, 0, self.candidate_distance_ptr,
+                                     self.candidate_neighbor_ptr,
+                                     self.candidate_point_ptr, 0)
+            return 0
 
-        cdef int num_components = self.tree.data.shape[0]
+        # every thread starts from the current candidates
+        self.thread_candidate_distance_arr[:] = self.candidate_distance_arr
+        self.thread_candidate_neighbor_arr[:] = self.candidate_neighbor_arr
+        self.thread_candidate_point_arr[:] = self.candidate_point_arr
+
+        first_root = 2 ** self.split_depth - 1
+        last_root = 2 ** (self.split_depth + 1) - 1
+        with nogil:
+            for query_root in prange(first_root, last_root,
+                                     num_threads=num_threads,
+                                     schedule='dynamic'):
+                t = threadid()
+                self.dual_tree_traversal(
+                    query_root, 0, &self.thread_candidate_distance[t, 0],
+                    &self.thread_candidate_neighbor[t, 0],
+                    &self.thread_candidate_point[t, 0], query_root)
+
+            for t in range(self.num_threads):
+                for c in range(self.num_points):
+                    if (self.thread_candidate_distance[t, c] <
+                            self.candidate_distance_ptr[c]):
+                        self.candidate_distance_ptr[c] = (
+                            self.thread_candidate_distance[t, c])
+                        self.candidate_neighbor_ptr[c] = (
+                            self.thread_candidate_neighbor[t, c])
+                        self.candidate_point_ptr[c] = (
+                            self.thread_candidate_point[t, c])
+        return 0
+
+    cpdef spanning_tree(self, core_distance=None, initial_edges=None):
+        """Compute the minimum spanning tree of the data held by
+        the tree passed in at construction, with respect to the given
+        core distances and initial edges (see reset), or the ones of
+        the last call to reset"""
+
+        if core_distance is not None:
+            self.reset(core_distance, initial_edges)
+        elif self.needs_reset:
+            raise ValueError(
+                "New core distances must be given before computing another spanning tree.")
+        self.needs_reset = True
+
+        cdef int num_components = self.components.shape[0]
         cdef int num_nodes = self.tree.node_data.shape[0]
         #cdef int iteration = 0
         while num_components > 1:
-            self.dual_tree_traversal(0, 0)
+            self.find_candidates()
             num_components = self.update_components()
             #iteration += 1
         #print(iteration)
@@ -0,0 +1,578 @@
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+
+# Authors: Luis Scoccola
+# License: 3-clause BSD
+
+
+
+import numpy as np
+cimport numpy as np
+ctypedef np.uint8_t uint8
+
+from borrowed._hdbscan_boruvka cimport BoruvkaUnionFind
+
+
+# The functions below (cut, cuts, the tomato-style and conservative
+# persistence-based flattenings, and condensed_tree) sweep the appearances of
+# points and the merges of a hierarchical clustering in the same way as
+# persistence_diagram_h0, and condensed_tree_conservative_flattening flattens
+# the tree recorded by such a sweep. The labels of the flat clusters are
+# numbered in the same order as the one given by the subsets of scipy's
+# DisjointSet, so that the flattenings coincide with the ones of the original
+# implementation in pure Python.
+
+
+cdef void _link(BoruvkaUnionFind uf, np.intp_t[:] nbrs, np.int64_t x, np.int64_t y):
+    # merges the components of x and y, and the circular lists of their members
+    cdef np.intp_t rx = uf.find(x)
+    cdef np.intp_t ry = uf.find(y)
+    cdef np.intp_t tmp
+    if rx != ry:
+        uf.union_(rx, ry)
+        tmp = nbrs[rx]
+        nbrs[rx] = nbrs[ry]
+        nbrs[ry] = tmp
+
+
+cdef void _label_subset(np.intp_t[:] nbrs, np.int_t[:] res, np.int64_t x, np.int_t label):
+    # labels all the points in the component of x
+    cdef np.int64_t nxt = x
+    while True:
+        res[nxt] = label
+        nxt = nbrs[nxt]
+        if nxt == x:
+            break
+
+
+cdef np.ndarray _label_subsets_by_insertion(BoruvkaUnionFind uf, np.int64_t[:] appearances, np.int64_t n_inserted, uint8[:] keep, np.int64_t n_points):
+    # labels the components containing the first n_inserted points in the
+    # order of appearance, numbering them by their first point in this order,
+    # and skipping the ones whose root is not kept
+    res = np.full(n_points, -1, dtype=np.int_)
+    cdef np.int_t[:] res_view = res
+    cdef np.int_t[:] root_label = np.full(n_points, -1, dtype=np.int_)
+    cdef uint8[:] root_seen = np.zeros(n_points, dtype=np.uint8)
+    cdef np.int_t current_cluster = 0
+    cdef np.int64_t i
+    cdef np.int64_t p
+    cdef np.int64_t rp
+    for i in range(n_inserted):
+        p = appearances[i]
+        rp = uf.find(p)
+        if not root_seen[rp]:
+            root_seen[rp] = True
+            if keep[rp]:
+                root_label[rp] = current_cluster
+                current_cluster += 1
+        res_view[p] = root_label[rp]
+    return res
+
+
+cpdef np.ndarray cut(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights):
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t n_merges = merges.shape[0]
+    if n_points == 0:
+        return np.full(0, -1, dtype=np.int_)
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    # contains the current clusters
+    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(n_points)
+    # height index
+    cdef np.int64_t hind = 0
+    # merge index
+    cdef np.int64_t mind = 0
+    cdef double current_appearence_height = heights[appearances[0]]
+    cdef double current_merge_height
+
+    if n_merges == 0:
+        current_merge_height = end
+    else:
+        current_merge_height = merges_heights[0]
+    while True:
+        # while there is no merge
+        while (
+            hind < n_points
+            and heights[appearances[hind]] <= current_merge_height
+            and heights[appearances[hind]] <= end
+        ):
+            # add all points that are born as new clusters
+            hind += 1
+            if hind == n_points:
+                current_appearence_height = end
+            else:
+                current_appearence_height = heights[appearances[hind]]
+        # while there is no cluster being born
+        while (
+            mind < n_merges
+            and merges_heights[mind] < current_appearence_height
+            and merges_heights[mind] <= end
+        ):
+            uf.union_(merges[mind, 0], merges[mind, 1])
+            mind += 1
+            if mind == n_merges:
+                current_merge_height = end
+            else:
+                current_merge_height = merges_heights[mind]
+        if (hind == n_points or heights[appearances[hind]] >= end) and (
+            mind == n_merges or merges_heights[mind] >= end
+        ):
+            break
+    return _label_subsets_by_insertion(
+        uf, appearances, hind, np.ones(n_points, dtype=np.uint8), n_points
+    )
+
+
+cpdef np.ndarray cuts(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights, double[:] cut_heights):
+    # labels of cut(min(end, cut_height), ...) for each cut height, which must
+    # be sorted in increasing order, computed in a single sweep. The sweep of
+    # cut processes all the appearances and merges below the cut height, in
+    # order, and then the ones at the cut height as follows: the points born
+    # at the cut height are added if the last event was not a merge, and the
+    # merges at the cut height are done if some point is born after the cut
+    # height; so the sweep of each cut continues the one of the previous cut.
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t n_merges = merges.shape[0]
+    cdef np.int64_t n_cuts = cut_heights.shape[0]
+    res = np.full((n_cuts, n_points), -1, dtype=np.int_)
+    if n_points == 0:
+        return res
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    # contains the current clusters
+    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(n_points)
+    cdef uint8[:] keep = np.ones(n_points, dtype=np.uint8)
+    # height index
+    cdef np.int64_t hind = 0
+    # merge index
+    cdef np.int64_t mind = 0
+    cdef bint last_was_merge = False
+    cdef double current_end
+    cdef np.int64_t c
+
+    for c in range(n_cuts):
+        current_end = min(end, cut_heights[c])
+        if c > 0 and current_end == min(end, cut_heights[c - 1]):
+            res[c] = res[c - 1]
+            continue
+        # the appearances and merges below the cut height
+        while True:
+            if (
+                hind < n_points
+                and heights[appearances[hind]] < current_end
+                and (mind == n_merges or heights[appearances[hind]] <= merges_heights[mind])
+            ):
+                hind += 1
+                last_was_merge = False
+            elif mind < n_merges and merges_heights[mind] < current_end:
+                uf.union_(merges[mind, 0], merges[mind, 1])
+                mind += 1
+                last_was_merge = True
+            else:
+                break
+        # the appearances and merges at the cut height
+        if not last_was_merge:
+            while hind < n_points and heights[appearances[hind]] <= current_end:
+                hind += 1
+        if hind < n_points and heights[appearances[hind]] > current_end:
+            while mind < n_merges and merges_heights[mind] <= current_end:
+                uf.union_(merges[mind, 0], merges[mind, 1])
+                mind += 1
+                last_was_merge = True
+        res[c] = _label_subsets_by_insertion(uf, appearances, hind, keep, n_points)
+    return res
+
+
+cpdef np.ndarray tomato_style_persistence_based_flattening(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights, double threshold, bint keep_low_persistence_clusters):
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t n_merges = merges.shape[0]
+    if n_points == 0:
+        return np.full(0, -1, dtype=np.int_)
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    # contains the current clusters
+    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(n_points)
+    # contains the birth time of clusters
+    cdef double[:] clusters_birth = np.full(n_points, -np.inf, dtype=float)
+    # height index
+    cdef np.int64_t hind = 0
+    # merge index
+    cdef np.int64_t mind = 0
+    cdef double current_appearence_height = heights[appearances[0]]
+    cdef double current_merge_height
+    cdef np.int64_t x
+    cdef np.int64_t y
+    cdef np.int64_t rx
+    cdef np.int64_t ry
+    cdef double bx
+    cdef double by
+    cdef uint8[:] keep
+
+    if n_merges == 0:
+        current_merge_height = end
+    else:
+        current_merge_height = merges_heights[0]
+    while True:
+        # while there is no merge
+        while (
+            hind < n_points
+            and heights[appearances[hind]] <= current_merge_height
+            and heights[appearances[hind]] < end
+        ):
+            # add all points that are born as new clusters
+            clusters_birth[appearances[hind]] = heights[appearances[hind]]
+            hind += 1
+            if hind == n_points:
+                current_appearence_height = end
+            else:
+                current_appearence_height = heights[appearances[hind]]
+        # while there is no cluster being born
+        while (
+            mind < n_merges
+            and merges_heights[mind] < current_appearence_height
+            and merges_heights[mind] < end
+        ):
+            x, y = merges[mind, 0], merges[mind, 1]
+            rx = uf.find(x)
+            ry = uf.find(y)
+            bx = clusters_birth[rx]
+            by = clusters_birth[ry]
+            # if one of them has not lived more than the threshold, merge them
+            # otherwise, don't
+            if (
+                bx + threshold > merges_heights[mind]
+                or by + threshold > merges_heights[mind]
+            ):
+                uf.union_(x, y)
+                clusters_birth[uf.find(x)] = min(bx, by)
+            mind += 1
+            if mind == n_merges:
+                current_merge_height = end
+            else:
+                current_merge_height = merges_heights[mind]
+        if (hind == n_points or heights[appearances[hind]] >= end) and (
+            mind == n_merges or merges_heights[mind] >= end
+        ):
+            break
+    # keep the clusters that have lived for longer than the threshold
+    keep = np.zeros(n_points, dtype=np.uint8)
+    for x in range(n_points):
+        keep[x] = (clusters_birth[x] + threshold <= end) or keep_low_persistence_clusters
+    return _label_subsets_by_insertion(uf, appearances, hind, keep, n_points)
+
+
+cpdef np.ndarray conservative_persistence_based_flattening(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights, double threshold):
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t n_merges = merges.shape[0]
+    res = np.full(n_points, -1, dtype=np.int_)
+    if n_points == 0:
+        return res
+    cdef np.int_t[:] res_view = res
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    # contains the current clusters
+    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(n_points)
+    # circular lists with the members of each cluster
+    cdef np.intp_t[:] nbrs = np.arange(n_points, dtype=np.intp)
+    # contains the birth time of clusters that are alive
+    cdef double[:] clusters_birth = np.full(n_points, -np.inf, dtype=float)
+    cdef uint8[:] clusters_died = np.zeros(n_points, dtype=np.uint8)
+    cdef uint8[:] inserted = np.zeros(n_points, dtype=np.uint8)
+    # label of the next flat cluster
+    cdef np.int_t current_cluster = 0
+    # height index
+    cdef np.int64_t hind = 0
+    # merge index
+    cdef np.int64_t mind = 0
+    cdef double current_appearence_height = heights[appearances[0]]
+    cdef double current_merge_height
+    cdef np.int64_t x
+    cdef np.int64_t y
+    cdef np.int64_t rx
+    cdef np.int64_t ry
+    cdef double bx
+    cdef double by
+
+    if n_merges == 0:
+        current_merge_height = end
+    else:
+        current_merge_height = merges_heights[0]
+    while True:
+        # while there is no merge
+        while (
+            hind < n_points
+            and heights[appearances[hind]] <= current_merge_height
+            and heights[appearances[hind]] < end
+        ):
+            # add all points that are born as new clusters
+            inserted[appearances[hind]] = True
+            clusters_birth[appearances[hind]] = heights[appearances[hind]]
+            hind += 1
+            if hind == n_points:
+                current_appearence_height = end
+            else:
+                current_appearence_height = heights[appearances[hind]]
+        # while there is no cluster being born
+        while (
+            mind < n_merges
+            and merges_heights[mind] < current_appearence_height
+            and merges_heights[mind] < end
+        ):
+            x, y = merges[mind, 0], merges[mind, 1]
+            rx = uf.find(x)
+            ry = uf.find(y)
+            # if both clusters are alive
+            if not clusters_died[rx] and not clusters_died[ry]:
+                bx = clusters_birth[rx]
+                by = clusters_birth[ry]
+                # if both have lived for more than the threshold, have them as flat clusters
+                if (
+                    bx + threshold <= merges_heights[mind]
+                    and by + threshold <= merges_heights[mind]
+                ):
+                    _label_subset(nbrs, res_view, x, current_cluster)
+                    _label_subset(nbrs, res_view, y, current_cluster + 1)
+                    current_cluster += 2
+                    _link(uf, nbrs, x, y)
+                    clusters_died[uf.find(x)] = True
+                # otherwise, merge them
+                else:
+                    _link(uf, nbrs, x, y)
+                    clusters_birth[uf.find(x)] = min(bx, by)
+            # if both clusters are already dead, just merge them into a dead cluster
+            elif clusters_died[rx] and clusters_died[ry]:
+                _link(uf, nbrs, x, y)
+                clusters_died[uf.find(x)] = True
+            # if only one of them is dead
+            else:
+                # we make it so that ry already died and rx just died
+                if clusters_died[rx]:
+                    x, y = y, x
+                    rx, ry = ry, rx
+                # if x has lived for longer than the threshold, have it as a flat cluster
+                if clusters_birth[rx] + threshold <= merges_heights[mind]:
+                    _label_subset(nbrs, res_view, x, current_cluster)
+                    current_cluster += 1
+                # then merge the clusters into a dead cluster
+                _link(uf, nbrs, x, y)
+                clusters_died[uf.find(x)] = True
+            mind += 1
+            if mind == n_merges:
+                current_merge_height = end
+            else:
+                current_merge_height = merges_heights[mind]
+        if (hind == n_points or heights[appearances[hind]] >= end) and (
+            mind == n_merges or merges_heights[mind] >= end
+        ):
+            break
+    # go through all clusters that have been born but haven't been merged
+    for x in range(n_points):
+        if inserted[x]:
+            rx = uf.find(x)
+            if not clusters_died[rx]:
+                if clusters_birth[rx] + threshold <= end:
+                    _label_subset(nbrs, res_view, x, current_cluster)
+                    current_cluster += 1
+                clusters_died[rx] = True
+    return res
+
+
+cpdef tuple condensed_tree(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights):
+    # Sweeps the hierarchical clustering as conservative_persistence_based_flattening
+    # does, but independently of any threshold, and records the tree of
+    # clusters. The nodes of the tree are the points, numbered from 0 to
+    # n_points - 1, followed by the merges of two distinct clusters, in the
+    # order in which they happen. Every node is a cluster, which is born at
+    # births[node] and merges with another one (or reaches end) at
+    # deaths[node]. The points are stored in an order in which the members of
+    # each node are the ones in order[starts[node]:starts[node]+sizes[node]].
+    # Also returns the children of each merge, the first one being the cluster
+    # of the first point of the merge, and the clusters alive at the end,
+    # ordered by their smallest point.
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t n_merges = merges.shape[0]
+    cdef np.int64_t max_nodes = n_points + max(n_points - 1, 0)
+    order = np.zeros(n_points, dtype=np.int64)
+    births = np.full(max_nodes, np.inf, dtype=float)
+    deaths = np.full(max_nodes, end, dtype=float)
+    starts = np.zeros(max_nodes, dtype=np.int64)
+    sizes = np.zeros(max_nodes, dtype=np.int64)
+    children = np.zeros((max(n_points - 1, 0), 2), dtype=np.int64)
+    if n_points == 0:
+        return order, births, deaths, starts, sizes, children, np.zeros(0, dtype=np.int64)
+    cdef np.int64_t[:] order_view = order
+    cdef double[:] births_view = births
+    cdef double[:] deaths_view = deaths
+    cdef np.int64_t[:] starts_view = starts
+    cdef np.int64_t[:] sizes_view = sizes
+    cdef np.int64_t[:,:] children_view = children
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    # contains the current clusters
+    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(n_points)
+    # node of the tree corresponding to each current cluster, by root
+    cdef np.int64_t[:] root_node = np.arange(n_points, dtype=np.int64)
+    # lists with the members of each current cluster, by root, and the first
+    # point of each node
+    cdef np.int64_t[:] list_head = np.arange(n_points, dtype=np.int64)
+    cdef np.int64_t[:] list_tail = np.arange(n_points, dtype=np.int64)
+    cdef np.int64_t[:] list_next = np.full(n_points, -1, dtype=np.int64)
+    cdef np.int64_t[:] node_head = np.zeros(max_nodes, dtype=np.int64)
+    cdef uint8[:] inserted = np.zeros(n_points, dtype=np.uint8)
+    cdef uint8[:] root_seen = np.zeros(n_points, dtype=np.uint8)
+    cdef list roots = []
+    cdef np.int64_t n_nodes = n_points
+    # height index
+    cdef np.int64_t hind = 0
+    # merge index
+    cdef np.int64_t mind = 0
+    cdef double current_appearence_height = heights[appearances[0]]
+    cdef double current_merge_height
+    cdef np.int64_t x
+    cdef np.int64_t y
+    cdef np.int64_t rx
+    cdef np.int64_t ry
+    cdef np.int64_t rxy
+    cdef np.int64_t nx
+    cdef np.int64_t ny
+    cdef np.int64_t position
+    cdef np.int64_t p
+
+    if n_merges == 0:
+        current_merge_height = end
+    else:
+        current_merge_height = merges_heights[0]
+    while True:
+        # while there is no merge
+        while (
+            hind < n_points
+            and heights[appearances[hind]] <= current_merge_height
+            and heights[appearances[hind]] < end
+        ):
+            # add all points that are born as new clusters
+            p = appearances[hind]
+            inserted[p] = True
+            births_view[p] = heights[p]
+            sizes_view[p] = 1
+            node_head[p] = p
+            hind += 1
+            if hind == n_points:
+                current_appearence_height = end
+            else:
+                current_appearence_height = heights[appearances[hind]]
+        # while there is no cluster being born
+        while (
+            mind < n_merges
+            and merges_heights[mind] < current_appearence_height
+            and merges_heights[mind] < end
+        ):
+            x, y = merges[mind, 0], merges[mind, 1]
+            rx = uf.find(x)
+            ry = uf.find(y)
+            if rx != ry:
+                nx = root_node[rx]
+                ny = root_node[ry]
+                deaths_view[nx] = merges_heights[mind]
+                deaths_view[ny] = merges_heights[mind]
+                children_view[n_nodes - n_points, 0] = nx
+                children_view[n_nodes - n_points, 1] = ny
+                births_view[n_nodes] = min(births_view[nx], births_view[ny])
+                sizes_view[n_nodes] = sizes_view[nx] + sizes_view[ny]
+                node_head[n_nodes] = list_head[rx]
+                # the members of y go after the ones of x
+                list_next[list_tail[rx]] = list_head[ry]
+                uf.union_(rx, ry)
+                rxy = uf.find(rx)
+                list_head[rxy] = node_head[n_nodes]
+                list_tail[rxy] = list_tail[ry]
+                root_node[rxy] = n_nodes
+                n_nodes += 1
+            mind += 1
+            if mind == n_merges:
+                current_merge_height = end
+            else:
+                current_merge_height = merges_heights[mind]
+        if (hind == n_points or heights[appearances[hind]] >= end) and (
+            mind == n_merges or merges_heights[mind] >= end
+        ):
+            break
+    # go through all clusters that have been born but haven't been merged,
+    # and concatenate their members
+    position = 0
+    for x in range(n_points):
+        if inserted[x]:
+            rx = uf.find(x)
+            if not root_seen[rx]:
+                root_seen[rx] = True
+                roots.append(root_node[rx])
+                p = list_head[rx]
+                while p != -1:
+                    order_view[position] = p
+                    starts_view[p] = position
+                    position += 1
+                    p = list_next[p]
+    for x in range(n_points, n_nodes):
+        starts_view[x] = starts_view[node_head[x]]
+    return (
+        order[:position],
+        births[:n_nodes],
+        deaths[:n_nodes],
+        starts[:n_nodes],
+        sizes[:n_nodes],
+        children[:n_nodes - n_points],
+        np.array(roots, dtype=np.int64),
+    )
+
+
+cpdef np.ndarray condensed_tree_conservative_flattening(np.int64_t n_points, np.int64_t[:] order, double[:] births, double[:] deaths, np.int64_t[:] starts, np.int64_t[:] sizes, np.int64_t[:,:] children, np.int64_t[:] roots, double threshold):
+    # conservative persistence-based flattening computed from a condensed tree
+    # in a single pass over its nodes, with the same labels as
+    # conservative_persistence_based_flattening
+    cdef np.int64_t n_nodes = births.shape[0]
+    cdef uint8[:] dead = np.zeros(n_nodes, dtype=np.uint8)
+    cdef np.int64_t[:] flat = np.zeros(n_nodes, dtype=np.int64)
+    cdef np.int64_t n_flat = 0
+    cdef np.int64_t j
+    cdef np.int64_t a
+    cdef np.int64_t b
+    cdef np.int64_t v
+    cdef np.int64_t i
+    cdef double h
+    res = np.full(n_points, -1, dtype=np.int_)
+    cdef np.int_t[:] res_view = res
+    for j in range(children.shape[0]):
+        a, b = children[j, 0], children[j, 1]
+        h = deaths[a]
+        # if both clusters are alive
+        if not dead[a] and not dead[b]:
+            # if both have lived for more than the threshold, have them as flat clusters
+            if births[a] + threshold <= h and births[b] + threshold <= h:
+                flat[n_flat] = a
+                flat[n_flat + 1] = b
+                n_flat += 2
+                dead[n_points + j] = True
+        # if both clusters are already dead, just merge them into a dead cluster
+        elif dead[a] and dead[b]:
+            dead[n_points + j] = True
+        # if only one of them is dead
+        else:
+            if dead[a]:
+                a, b = b, a
+            # if a has lived for longer than the threshold, have it as a flat cluster
+            if births[a] + threshold <= h:
+                flat[n_flat] = a
+                n_flat += 1
+            dead[n_points + j] = True
+    # go through all clusters that have been born but haven't been merged
+    for i in range(roots.shape[0]):
+        v = roots[i]
+        if not dead[v] and births[v] + threshold <= deaths[v]:
+            flat[n_flat] = v
+            n_flat += 1
+    for i in range(n_flat):
+        v = flat[i]
+        for j in range(starts[v], starts[v] + sizes[v]):
+            res_view[order[j]] = i
+    return res
@@ -9,22 +9,35 @@ from .borrowed._hdbscan_boruvka import (
 from .borrowed.prim_mst import mst_linkage_core_vector
 from .borrowed.dense_mst import stepwise_dendrogram_with_core_distances
 from .borrowed.dist_metrics import DistanceMetric
-from .auxiliary import lazy_intersection
+from .auxiliary import (
+    lazy_intersections,
+    searchsorted_rows,
+    core_distances_of_lines,
+    kruskal,
+)
 from .subsampling import close_subsample_fast_metric, close_subsample_distance_matrix
-from .persistence_diagram_h0 import persistence_diagram_h0
+from .persistence_diagram_h0 import persistence_diagram_h0, persistence_diagrams_h0
+from .flattening import (
+    cut,
+    cuts,
+    tomato_style_persistence_based_flattening,
+    conservative_persistence_based_flattening,
+    condensed_tree,
+    condensed_tree_conservative_flattening,
+)
 from .signed_betti_numbers import (
     signed_betti,
     rank_decomposition_2d_rectangles,
     rank_decomposition_2d_rectangles_to_hooks,
+    rank_invariant_slice_differences_of_boxes,
+    rank_decomposition_2d_rectangles_sparse,
+    rank_decomposition_2d_rectangles_to_hooks_sparse,
 )
 import numpy as np
 import warnings
+from threading import Lock, local
+from collections import OrderedDict
 from sklearn.neighbors import KDTree, BallTree
-from scipy.cluster.hierarchy import DisjointSet
-from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import (
-    minimum_spanning_tree as sparse_matrix_minimum_spanning_tree,
-)
 from scipy.stats import mode
 from joblib import Parallel, delayed
 from joblib.parallel import cpu_count
@@ -37,8 +50,57 @@ balltree_valid_metrics = BallTree.valid_metrics
 _TOL = 1e-08
 # starting when we consider a dataset large
 _MANY_POINTS = 40000
+# maximum number of entries of a block of core distances computed at once
+_MAX_CORE_DISTANCES_ENTRIES = 2**24
+# number of points whose neighbors are queried at once in a vertical line
+_RIPS_GRAPH_CHUNK_SIZE = 2**10
+# maximum number of bytes of the horizontal linkages kept for DBSCAN clusterings
+_MAX_HORIZONTAL_LINKAGES_BYTES = 2**28
+# maximum total number of points of the spliced hierarchical clusterings of the
+# rank invariant that are built and reduced at once
+_MAX_SPLICED_POINTS = 2**24
+# number of lines of the exact Hilbert function above which we warn about its cost
+_MAX_EXACT_HILBERT_LINES = 2000
+
+
+
+
+def _startend_to_intercepts(start, end):
+    if end[0] == np.infty or start[1] == end[1]:
+        k_intercept = start[1]
+        s_intercept = np.infty
+    else:
+        slope = (end[1] - start[1]) / (end[0] - start[0])
+        k_intercept = -start[0] * slope + start[1]
+        s_intercept = -k_intercept / slope
+    return s_intercept, k_intercept
+
+
+# records whether the current thread is running a worker of
+# parallel_computation, in which case computations should not start threads of
+# their own, since there are already n_jobs workers
+_worker_state = local()
 
 
+def _in_parallel_worker():
+    return getattr(_worker_state, "in_worker", False)
+
+
+def _run_in_worker(function):
+    def run(inp):
+        _worker_state.in_worker = True
+        try:
+            return function(inp)
+        finally:
+            _worker_state.in_worker = False
+
+    return run
+
+
+def _kernel_threads():
+    # number of threads of the multithreaded kernels of auxiliary, which only
+    # use one thread when they already run inside a worker
+    return 1 if _in_parallel_worker() else cpu_count()
 
 
 def parallel_computation(function, inputs, n_jobs, debug=False, threading=False):
@@ -47,6 +109,7 @@ def parallel_computation(function, inputs, n_jobs, debug=False, threading=False)
     else:
         verbose = 11 if debug else 0
         n_jobs = min(cpu_count(), n_jobs)
+        function = _run_in_worker(function)
         if threading:
             return Parallel(n_jobs=n_jobs, backend="threading", verbose=verbose)(
                 delayed(function)(inp) for inp in inputs
@@ -57,6 +120,45 @@ def parallel_computation(function, inputs, n_jobs, debug=False, threading=False)
             )
 
 
+def _split_for_workers(inputs, n_jobs):
+    # splits the inputs into a few chunks per worker of parallel_computation,
+    # or into a single chunk if there are no workers
+    if n_jobs == 1 or len(inputs) == 0:
+        return [inputs]
+    n_workers = min(cpu_count(), n_jobs) if n_jobs > 0 else cpu_count()
+    n_chunks = min(len(inputs), 4 * n_workers)
+    return [
+        [inputs[i] for i in chunk]
+        for chunk in np.array_split(np.arange(len(inputs)), n_chunks)
+    ]
+
+
+def _persistence_diagrams(hcs, reduced=False, tol=_TOL, n_jobs=1):
+    # computes the persistence diagrams of a list of hierarchical clusterings
+    # with a single call to the multithreaded kernel, by packing them one after
+    # the other
+    if len(hcs) == 0:
+        return []
+    n_threads = min(cpu_count(), n_jobs) if n_jobs > 0 else cpu_count() + 1 + n_jobs
+    point_offsets = np.zeros(len(hcs) + 1, dtype=np.int64)
+    np.cumsum([len(hc._heights) for hc in hcs], out=point_offsets[1:])
+    merge_offsets = np.zeros(len(hcs) + 1, dtype=np.int64)
+    np.cumsum([len(hc._merges) for hc in hcs], out=merge_offsets[1:])
+    offsets, bars = persistence_diagrams_h0(
+        np.array([hc._end for hc in hcs], dtype=float),
+        point_offsets,
+        np.concatenate([hc._heights for hc in hcs]),
+        merge_offsets,
+        # need to cast explicitly to int64 for windows compatibility
+        np.concatenate([hc._merges for hc in hcs]).astype(np.int64),
+        np.concatenate([hc._merges_heights for hc in hcs]),
+        tol=tol,
+        reduced=reduced,
+        n_threads=max(1, n_threads),
+    )
+    return [bars[offsets[i] : offsets[i + 1]] for i in range(len(hcs))]
+
+
 class Persistable:
     """Density-based clustering on finite metric spaces.
     
@@ -98,9 +200,10 @@ class Persistable:
         significantly slower because of the GIL, but the backend ``loky`` does
         not work well in some systems.
 
-    n_jobs: int, default is 1
+    n_jobs: int, default is 4
         Number of processes or threads to use to fit the data structures, for exaple
-        to compute the nearest neighbors of all points in the dataset.
+        to compute the nearest neighbors of all points in the dataset, and number
+        of threads used to compute the minimum spanning trees in ``cluster``.
 
     ``**kwargs``:
         Passed to ``KDTree`` or ``BallTree``.
@@ -152,7 +255,6 @@ class Persistable:
             )
             self._subsample = subsample_indices.shape[0]
 
-            X = X.copy()
             if metric == "precomputed":
                 X = X[subsample_indices, :][:, subsample_indices]
             else:
@@ -160,10 +262,11 @@ class Persistable:
             self._subsample_representatives = subsample_representatives
 
             # compute measure for subsample
-            new_measure = np.zeros(self._subsample)
-            for i, _ in enumerate(self._subsample_representatives):
-                new_measure[self._subsample_representatives[i]] += measure[i]
-            measure = new_measure
+            measure = np.bincount(
+                self._subsample_representatives,
+                weights=measure,
+                minlength=self._subsample,
+            )
 
         # if metric is minkowski but no p was passed, assume p = 2
         if metric == "minkowski" and "p" not in kwargs:
@@ -205,6 +308,24 @@ class Persistable:
             threading=threading,
         )
 
+        # horizontal linkages used for DBSCAN-style clusterings, by density
+        # level, from least to most recently used
+        self._horizontal_linkages = OrderedDict()
+        self._horizontal_linkages_nbytes = 0
+        self._horizontal_linkages_lock = Lock()
+
+    def __getstate__(self):
+        # the lock cannot be pickled, and the cached linkages can be recomputed
+        state = self.__dict__.copy()
+        state["_horizontal_linkages"] = OrderedDict()
+        state["_horizontal_linkages_nbytes"] = 0
+        del state["_horizontal_linkages_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._horizontal_linkages_lock = Lock()
+
     def cluster(
         self,
         n_clusters,
@@ -212,6 +333,7 @@ class Persistable:
         end,
         flattening_mode="conservative",
         keep_low_persistence_clusters=False,
+        labels_file=None,
     ):
         """Cluster dataset passed at initialization.
 
@@ -246,6 +368,11 @@ class Persistable:
             associated to the selected n_clusters. If set to True, the number of clusters
             can be larger than the selected one.
 
+        labels_file: None or string, optional, default is None
+            If not None, path of a ``.npy`` file where the labels are written,
+            in which case the labels are returned as a memory-mapped array
+            backed by this file, which is useful for very large datasets.
+
         returns:
             A numpy array of length the number of points in the dataset containing
             integers from -1 to the number of clusters minus 1, representing the
@@ -267,26 +394,117 @@ class Persistable:
             keep_low_persistence_clusters=keep_low_persistence_clusters,
         )
 
-        if self._subsample is not None:
-            new_cl = np.full(self._subsample_representatives.shape[0], -1)
-            for i, _ in enumerate(self._subsample_representatives):
-                new_cl[i] = cl[self._subsample_representatives[i]]
-            cl = new_cl
+        return self._labels_of_dataset(cl, labels_file=labels_file)
 
-        return cl
+    def clusterings(
+        self,
+        n_clusters,
+        start,
+        end,
+        flattening_mode="conservative",
+        keep_low_persistence_clusters=False,
+    ):
+        """Cluster dataset passed at initialization, once for each of several
+        numbers of clusters. This is equivalent to calling ``cluster`` for each
+        of them, but the hierarchical clustering of the segment is computed
+        only once.
 
-    def _dbscan_cluster(self, xy):
-        x,y = xy
-        hc = self._bifiltration.lambda_linkage([0,y], [np.inf, y])
-        cl = hc.cut(x)
+        n_clusters: list of int
+            Integers determining how many clusters each of the final clusterings
+            must have.
+
+        start, end, flattening_mode, keep_low_persistence_clusters:
+            As in ``cluster``.
+
+        returns:
+            A list with a clustering, as returned by ``cluster``, for each
+            entry of ``n_clusters``.
+
+        """
 
+        start, end = np.array(start), np.array(end)
+        if start.shape != (2,) or end.shape != (2,):
+            raise ValueError("start and end must both be points on the plane.")
+        if np.any(np.array(n_clusters) < 1):
+            raise ValueError("n_clusters must be greater than 0.")
+        hc = self._bifiltration.lambda_linkage(start, end)
+        condensed_tree = hc.condensed_tree()
+
+        res = []
+        for n in n_clusters:
+            threshold = condensed_tree._compute_threshold(n)
+            cl = condensed_tree.persistence_based_flattening(
+                threshold,
+                flattening_mode=flattening_mode,
+                keep_low_persistence_clusters=keep_low_persistence_clusters,
+            )
+
+            res.append(self._labels_of_dataset(cl))
+
+        return res
+
+    def _labels_of_dataset(self, cl, labels_file=None):
+        # labels of the points of the dataset given the labels of the subsample,
+        # written to a memory-mapped .npy file if labels_file is given
+        if labels_file is None:
+            if self._subsample is not None:
+                return cl[self._subsample_representatives]
+            return cl
+
+        if self._subsample is not None:
+            n_points = self._subsample_representatives.shape[0]
+        else:
+            n_points = cl.shape[0]
+        out = np.lib.format.open_memmap(
+            labels_file, mode="w+", dtype=cl.dtype, shape=(n_points,)
+        )
         if self._subsample is not None:
-            new_cl = np.full(self._subsample_representatives.shape[0], -1)
-            for i, _ in enumerate(self._subsample_representatives):
-                new_cl[i] = cl[self._subsample_representatives[i]]
-            cl = new_cl
+            np.take(cl, self._subsample_representatives, out=out)
+        else:
+            out[:] = cl
+        out.flush()
+        return out
+
+    def _horizontal_linkage(self, y):
+        with self._horizontal_linkages_lock:
+            if y in self._horizontal_linkages:
+                self._horizontal_linkages.move_to_end(y)
+                return self._horizontal_linkages[y]
+        hc = self._bifiltration.lambda_linkage([0, y], [np.inf, y])
+        nbytes = hc._heights.nbytes + hc._merges.nbytes + hc._merges_heights.nbytes
+        with self._horizontal_linkages_lock:
+            if y not in self._horizontal_linkages:
+                self._horizontal_linkages[y] = hc
+                self._horizontal_linkages_nbytes += nbytes
+            # evict the least recently used linkages, but keep the last one
+            while (
+                self._horizontal_linkages_nbytes > _MAX_HORIZONTAL_LINKAGES_BYTES
+                and len(self._horizontal_linkages) > 1
+            ):
+                _, evicted = self._horizontal_linkages.popitem(last=False)
+                self._horizontal_linkages_nbytes -= (
+                    evicted._heights.nbytes
+                    + evicted._merges.nbytes
+                    + evicted._merges_heights.nbytes
+                )
+        return hc
 
-        return cl
+    def _dbscan_cluster(self, xy):
+        return self._dbscan_clusters([xy])[0]
+
+    def _dbscan_clusters(self, xys):
+        """DBSCAN-style clusterings, one for each pair ``(x, y)`` of a distance
+        scale ``x`` and a density level ``y``. The horizontal linkage of each
+        density level is computed once, and cached, and all the distance scales
+        of a density level are labeled in a single sweep over its merges."""
+        xys = np.array(xys, dtype=float).reshape(-1, 2)
+        res = [None] * xys.shape[0]
+        for y in np.unique(xys[:, 1]):
+            indices = np.nonzero(xys[:, 1] == y)[0]
+            hc = self._horizontal_linkage(y)
+            for i, cl in zip(indices, hc.cuts(xys[indices, 0])):
+                res[i] = self._labels_of_dataset(cl)
+        return res
 
     def _find_end(self):
         return self._bifiltration.find_end()
@@ -308,23 +526,74 @@ class Persistable:
         granularity,
         reduced=False,
         n_jobs=1,
+        adaptive_depth=0,
+        approximate=False,
     ):
         return self._bifiltration.hilbert_function_on_regular_grid(
-            min_s, max_s, max_k, min_k, granularity, reduced=reduced, n_jobs=n_jobs
+            min_s,
+            max_s,
+            max_k,
+            min_k,
+            granularity,
+            reduced=reduced,
+            n_jobs=n_jobs,
+            adaptive_depth=adaptive_depth,
+            approximate=approximate,
         )
 
     def _rank_invariant(
-        self, min_s, max_s, max_k, min_k, granularity, reduced=False, n_jobs=1
+        self,
+        min_s,
+        max_s,
+        max_k,
+        min_k,
+        granularity,
+        reduced=False,
+        n_jobs=1,
+        sparse=False,
     ):
         return self._bifiltration.rank_invariant_on_regular_grid(
-            min_s, max_s, max_k, min_k, granularity, reduced=reduced, n_jobs=n_jobs
+            min_s,
+            max_s,
+            max_k,
+            min_k,
+            granularity,
+            reduced=reduced,
+            n_jobs=n_jobs,
+            sparse=sparse,
+        )
+
+    def _hilbert_function_exact(
+        self, min_s, max_s, max_k, min_k, reduced=False, n_jobs=1, approximate=False
+    ):
+        return self._bifiltration.hilbert_function_exact(
+            min_s,
+            max_s,
+            max_k,
+            min_k,
+            reduced=reduced,
+            n_jobs=n_jobs,
+            approximate=approximate,
         )
 
     def _linear_vineyard(
-        self, start_end1, start_end2, n_parameters, reduced=False, n_jobs=1
+        self,
+        start_end1,
+        start_end2,
+        n_parameters,
+        reduced=False,
+        n_jobs=1,
+        incremental=False,
+        approximate=False,
     ):
         return self._bifiltration.linear_vineyard(
-            start_end1, start_end2, n_parameters, reduced=reduced, n_jobs=n_jobs
+            start_end1,
+            start_end2,
+            n_parameters,
+            reduced=reduced,
+            n_jobs=n_jobs,
+            incremental=incremental,
+            approximate=approximate,
         )
 
 
@@ -341,58 +610,33 @@ class _DegreeRipsBifiltration:
 
         max_k = k_intercept if max_k is None else max_k
         if s_intercept != np.inf:
-            i_indices_and_finished_at_last_index = []
-            mu = s_intercept / k_intercept
-            k_to_s = lambda y: s_intercept - mu * y
-            max_k_larger_last_kernel_estimate = []
-            for p in point_index:
-                i_indices_and_finished_at_last_index.append(
-                    lazy_intersection(
-                        kernel_estimate[p],
-                        nn_distance[p],
-                        s_intercept,
-                        k_intercept,
-                    )
-                )
-                max_k_larger_last_kernel_estimate.append(
-                    (kernel_estimate[p, -1] < max_k)
-                )
-            max_k_larger_last_kernel_estimate = np.array(
-                max_k_larger_last_kernel_estimate
-            )
-            i_indices_and_finished_at_last_index = np.array(
-                i_indices_and_finished_at_last_index
+            # the kernel computes, for all points at once, the lazy intersection
+            # of the line with the kernel estimate of the point, and checks if
+            # for any point we don't have enough neighbors to properly compute
+            # its core scale; for this, the lazy intersection must have finished
+            # at the last index and the max_k of the line segment chosen must be
+            # larger than the max kernel estimate for the point
+            core_distances, not_enough_neighbors = lazy_intersections(
+                kernel_estimate[point_index],
+                nn_distance[point_index],
+                s_intercept,
+                k_intercept,
+                max_k,
+                n_threads=_kernel_threads(),
             )
-            i_indices = i_indices_and_finished_at_last_index[:, 0]
-            finished_at_last_index = i_indices_and_finished_at_last_index[:, 1]
-            # check if for any points we don't have enough neighbors to properly compute its core scale
-            # for this, the lazy intersection must have finished at the last index and the max_k
-            # of the line segment chosen must be larger than the max kernel estimate for the point
-            if np.any(
-                np.logical_and(
-                    finished_at_last_index, max_k_larger_last_kernel_estimate
-                )
-            ):
+            if not_enough_neighbors:
                 warnings.warn(
                     "Don't have enough neighbors to properly compute core scale, or point takes too long to appear."
                 )
-
-            def op(p, i):
-                return np.where(
-                    k_to_s(kernel_estimate[p, i - 1]) <= nn_distance[p, i],
-                    k_to_s(kernel_estimate[p, i - 1]),
-                    nn_distance[p, i],
-                )
-
-            return np.where(i_indices == 0, 0, op(point_index, i_indices))
+            return core_distances
         else:
-            i_indices = []
-            for p in point_index:
-                idx = np.searchsorted(kernel_estimate[p], k_intercept, side="left")
-                if idx == nn_distance[p].shape[0]:
-                    idx -= 1
-                i_indices.append(idx)
-            i_indices = np.array(i_indices)
+            i_indices = searchsorted_rows(
+                kernel_estimate[point_index],
+                k_intercept,
+                side="left",
+                n_threads=_kernel_threads(),
+            )
+            i_indices = np.minimum(i_indices, nn_distance.shape[1] - 1)
             # TODO: properly check and warn of not enough n_neighbors or
             # explicitly ensure that the following does not happen:
             # if self._n_neighbors < self._size:
@@ -482,34 +726,81 @@ class _DegreeRipsBifiltration:
 
         return res_hierarchical_clustering
 
-    def _lambda_linkage_skew(self, start, end):
-        def _startend_to_intercepts(start, end):
-            if end[0] == np.infty or start[1] == end[1]:
-                k_intercept = start[1]
-                s_intercept = np.infty
-            else:
-                slope = (end[1] - start[1]) / (end[0] - start[0])
-                k_intercept = -start[0] * slope + start[1]
-                s_intercept = -k_intercept / slope
-            return s_intercept, k_intercept
-
+    def _lambda_linkage_skew(
+        self, start, end, core_distances=None, single_linkage=None
+    ):
         hc_start = start[0]
         hc_end = end[0]
-        indices = np.arange(self._mpspace.size())
-        s_intercept, k_intercept = _startend_to_intercepts(start, end)
-        max_k = start[1]
-        core_distances = self._core_distance(indices, s_intercept, k_intercept, max_k)
+        if core_distances is None:
+            indices = np.arange(self._mpspace.size())
+            s_intercept, k_intercept = _startend_to_intercepts(start, end)
+            max_k = start[1]
+            core_distances = self._core_distance(
+                indices, s_intercept, k_intercept, max_k
+            )
 
-        core_distances = np.minimum(hc_end, core_distances)
-        core_distances = np.maximum(hc_start, core_distances)
+            core_distances = np.minimum(hc_end, core_distances)
+            core_distances = np.maximum(hc_start, core_distances)
 
-        single_linkage_hc = self._mpspace.generalized_single_linkage(core_distances)
+        if single_linkage is None:
+            single_linkage = self._mpspace.generalized_single_linkage
+        single_linkage_hc = single_linkage(core_distances)
 
         single_linkage_hc.clip(hc_start, hc_end)
 
         return single_linkage_hc
 
-    def lambda_linkage(self, start, end):
+    def _core_distances_of_lines(self, startends):
+        """Return the core distances of all points with respect to each of
+        the given non-vertical lines, as an array of shape (n_points, n_lines)
+        whose columns are clipped to the range of the corresponding line."""
+        starts = np.array([start for start, _ in startends], dtype=float)
+        ends = np.array([end for _, end in startends], dtype=float)
+        intercepts = np.array(
+            [_startend_to_intercepts(start, end) for start, end in startends],
+            dtype=float,
+        )
+        core_distances, not_enough_neighbors = core_distances_of_lines(
+            self._mpspace.kernel_estimate(),
+            self._mpspace.nn_distance(),
+            intercepts[:, 0],
+            intercepts[:, 1],
+            starts[:, 1],
+            n_threads=_kernel_threads(),
+        )
+        if np.any(not_enough_neighbors):
+            warnings.warn(
+                "Don't have enough neighbors to properly compute core scale, or point takes too long to appear."
+            )
+        core_distances = np.minimum(ends[:, 0], core_distances)
+        core_distances = np.maximum(starts[:, 0], core_distances)
+        return core_distances
+
+    def _lines_with_core_distances(self, startends):
+        """Split the lines into blocks and, for each block, return a list of
+        triples ``(start, end, core_distances)``, where the core distances of
+        all non-vertical lines of the block are computed at once, and are
+        ``None`` for vertical lines."""
+        block_size = max(1, _MAX_CORE_DISTANCES_ENTRIES // self._mpspace.size())
+        for i in range(0, len(startends), block_size):
+            block = startends[i : i + block_size]
+            non_vertical = [
+                j for j, (start, end) in enumerate(block) if start[0] != end[0]
+            ]
+            core_distances = [None] * len(block)
+            if len(non_vertical) > 0:
+                block_core_distances = self._core_distances_of_lines(
+                    [block[j] for j in non_vertical]
+                )
+                for l, j in enumerate(non_vertical):
+                    core_distances[j] = np.ascontiguousarray(
+                        block_core_distances[:, l]
+                    )
+            yield [
+                (start, end, cd) for (start, end), cd in zip(block, core_distances)
+            ]
+
+    def lambda_linkage(self, start, end, core_distances=None, single_linkage=None):
         if start[0] > end[0] or start[1] < end[1]:
             raise ValueError("Parameters do not give a monotonic line.")
 
@@ -519,23 +810,81 @@ class _DegreeRipsBifiltration:
             k_end = end[1]
             return self._lambda_linkage_vertical(s_intercept, k_start, k_end)
         else:
-            return self._lambda_linkage_skew(start, end)
-
-    def lambda_linkage_vineyard(self, startends, reduced=False, tol=_TOL, n_jobs=1):
-        run_in_parallel = lambda startend: self.lambda_linkage(
-            startend[0], startend[1]
-        ).persistence_diagram(tol=tol, reduced=reduced)
+            return self._lambda_linkage_skew(
+                start, end, core_distances, single_linkage
+            )
 
-        return parallel_computation(
-            run_in_parallel,
-            startends,
-            n_jobs,
-            debug=self._debug,
-            threading=self._threading,
-        )
+    def lambda_linkage_vineyard(
+        self,
+        startends,
+        reduced=False,
+        tol=_TOL,
+        n_jobs=1,
+        incremental=False,
+        approximate=False,
+    ):
+        # if approximate is True, the non-vertical lines are computed with
+        # approximate_generalized_single_linkage, and a warning reports the
+        # largest error bound, by which every birth and death may be late
+        if incremental and approximate:
+            raise ValueError("incremental and approximate cannot be used together.")
+
+        def run_in_parallel(chunk):
+            # each worker computes the diagrams of its chunk of lines with a
+            # single call to the batched kernel, and only sends back diagrams
+            # together with the error bound of its approximate linkages
+            single_linkage = (
+                _ApproximateSingleLinkage(self._mpspace) if approximate else None
+            )
+            hcs = [
+                self.lambda_linkage(start, end, core_distances, single_linkage)
+                for start, end, core_distances in chunk
+            ]
+            error_bound = 0 if single_linkage is None else single_linkage.error_bound
+            return _persistence_diagrams(hcs, reduced=reduced, tol=tol), error_bound
+
+        pds = []
+        error_bound = 0
+        if incremental:
+            # the lines are computed in order, each one starting from the
+            # minimum spanning tree of the previous one
+            single_linkage = _IncrementalSingleLinkage(self._mpspace)
+        for block in self._lines_with_core_distances(startends):
+            if incremental:
+                hcs = [
+                    self.lambda_linkage(start, end, core_distances, single_linkage)
+                    for start, end, core_distances in block
+                ]
+                pds += _persistence_diagrams(
+                    hcs, reduced=reduced, tol=tol, n_jobs=n_jobs
+                )
+            else:
+                for chunk_pds, chunk_error_bound in parallel_computation(
+                    run_in_parallel,
+                    _split_for_workers(block, n_jobs),
+                    n_jobs,
+                    debug=self._debug,
+                    threading=self._threading,
+                ):
+                    pds += chunk_pds
+                    error_bound = max(error_bound, chunk_error_bound)
+        if error_bound > 0:
+            warnings.warn(
+                "Approximate single linkage was used: births and deaths may be up to "
+                + str(error_bound)
+                + " later than the exact ones."
+            )
+        return pds
 
     def linear_vineyard(
-        self, start_end1, start_end2, n_parameters, reduced=False, n_jobs=1
+        self,
+        start_end1,
+        start_end2,
+        n_parameters,
+        reduced=False,
+        n_jobs=1,
+        incremental=False,
+        approximate=False,
     ):
         start1, end1 = start_end1
         start2, end2 = start_end2
@@ -561,10 +910,19 @@ class _DegreeRipsBifiltration:
             )
         )
         startends = list(zip(starts, ends))
-        pds = self.lambda_linkage_vineyard(startends, reduced=reduced, n_jobs=n_jobs)
+        pds = self.lambda_linkage_vineyard(
+            startends,
+            reduced=reduced,
+            n_jobs=n_jobs,
+            incremental=incremental,
+            approximate=approximate,
+        )
         return Vineyard(startends, pds)
 
-    def _rank_invariant(self, ss, ks, reduced=False, n_jobs=1):
+    def _rank_invariant(self, ss, ks, reduced=False, n_jobs=1, sparse=False):
+        # if sparse is True, the rank invariant is returned in the sparse layout
+        # of signed_betti_numbers, one slice at a time, so that it is never
+        # stored as a dense array
         # go on one more step to compute rank invariant at the end of the grid
         ss = list(ss)
         ks = list(ks)
@@ -577,16 +935,18 @@ class _DegreeRipsBifiltration:
         startends_vertical = [[[s, ks[0]], [s, ks[-1]]] for s in ss]
         startends = startends_horizontal + startends_vertical
 
-        def run_in_parallel(startend):
-            return self.lambda_linkage(startend[0], startend[1])
-
-        hcs = parallel_computation(
-            run_in_parallel,
-            startends,
-            n_jobs,
-            debug=self._debug,
-            threading=self._threading,
-        )
+        def run_in_parallel(startend_core_distances):
+            return self.lambda_linkage(*startend_core_distances)
+
+        hcs = []
+        for block in self._lines_with_core_distances(startends):
+            hcs += parallel_computation(
+                run_in_parallel,
+                block,
+                n_jobs,
+                debug=self._debug,
+                threading=self._threading,
+            )
         hcs_horizontal = hcs[:n_k]
         for hc in hcs_horizontal:
             hc.snap_to_grid(ss)
@@ -635,40 +995,87 @@ class _DegreeRipsBifiltration:
 
             return _HierarchicalClustering(heights, merges, merges_heights, start, end)
 
-        def _pd_spliced_hc(s_index_k_index):
-            s_index, k_index = s_index_k_index
-            return _splice_hcs(s_index, k_index).persistence_diagram(reduced=reduced)
-
-        indices = [
-            [s_index, k_index] for s_index in range(n_s) for k_index in range(n_k)
-        ]
-        pds = parallel_computation(
-            _pd_spliced_hc,
-            indices,
+        # the spliced hierarchical clusterings are built and reduced in chunks,
+        # with one call to the batched kernel per chunk
+        chunk_size = max(1, _MAX_SPLICED_POINTS // self._mpspace.size())
+
+        def _rank_invariant_row(s_index):
+            # returns the slice ri[:, :, s_index, :] of the rank invariant, which
+            # only depends on the spliced hierarchical clusterings of this row of
+            # the grid; the last row and column are not computed, since they are
+            # discarded at the end.
+            # A bar [b, d) of the diagram at (s_index, k_index) adds one to the
+            # box [b, s_index] x {k_index} x [k_index, k_index + d - s_index)
+            # of the slice. In the dense layout, the slice is accumulated in a
+            # difference array, so each box only touches its four corners, and
+            # the boxes are filled in with cumulative sums at the end. In the
+            # sparse layout, the slice differences are computed directly from
+            # the boxes, so that no array of the size of the slice is built
+            boxes = []
+            for k_start in range(0, n_k - 1, chunk_size):
+                k_indices = np.arange(k_start, min(k_start + chunk_size, n_k - 1))
+                hcs = [_splice_hcs(s_index, k_index) for k_index in k_indices]
+                pds = _persistence_diagrams(hcs, reduced=reduced)
+                n_bars = [len(pd) for pd in pds]
+                bars = np.concatenate(pds).astype(int)
+                b, d = bars[:, 0], bars[:, 1]
+                k_index = np.repeat(k_indices, n_bars)
+                # this may be unnecessary
+                keep = (b <= s_index) & (d >= s_index)
+                b, d, k_index = b[keep], d[keep], k_index[keep]
+                j_end = np.minimum(d - s_index + k_index, n_k)
+                boxes.append((b, k_index, j_end))
+            b, k_index, j_end = (np.concatenate(x) for x in zip(*boxes))
+            if sparse:
+                return rank_invariant_slice_differences_of_boxes(
+                    b,
+                    np.full(len(b), s_index + 1),
+                    k_index,
+                    k_index,
+                    j_end,
+                    (n_s - 1, n_k - 1, n_k - 1),
+                )
+            ri_row = np.zeros((n_s + 1, n_k - 1, n_k + 1), dtype=int)
+            np.add.at(ri_row, (b, k_index, k_index), 1)
+            np.add.at(ri_row, (s_index + 1, k_index, k_index), -1)
+            np.add.at(ri_row, (b, k_index, j_end), -1)
+            np.add.at(ri_row, (s_index + 1, k_index, j_end), 1)
+            np.cumsum(ri_row, axis=0, out=ri_row)
+            np.cumsum(ri_row, axis=2, out=ri_row)
+            return ri_row[:-2, :, :-2]
+
+        # each worker splices and reduces a whole row of the grid, and only
+        # sends back its slice of the rank invariant
+        ri_rows = parallel_computation(
+            _rank_invariant_row,
+            range(n_s - 1),
             n_jobs,
             debug=self._debug,
             threading=self._threading,
         )
-        pds = [[indices[i][0], indices[i][1], pds[i]] for i in range(len(indices))]
-
-        ri = np.zeros((n_s, n_k, n_s, n_k), dtype=int)
-
-        for s_index, k_index, pd in pds:
-            for bar in pd:
-                b, d = bar
-                b, d = int(b), int(d)
-                # this if may be unnecessary
-                if b <= s_index and d >= s_index:
-                    for i in range(b, s_index + 1):
-                        for j in range(s_index, d):
-                            ri[i, k_index, s_index, j - s_index + k_index] += 1
-
-        ri = ri[:-1, :, :, :][:, :-1, :, :][:, :, :-1, :][:, :, :, :-1]
+        if sparse:
+            return ri_rows
+        ri = np.stack(ri_rows, axis=2)
         return ri
 
     def rank_invariant_on_regular_grid(
-        self, min_s, max_s, max_k, min_k, granularity, reduced=False, n_jobs=1
+        self,
+        min_s,
+        max_s,
+        max_k,
+        min_k,
+        granularity,
+        reduced=False,
+        n_jobs=1,
+        sparse=False,
     ):
+        # returns ss, ks, ri, rdr, rdh, where ri is the rank invariant, rdr its
+        # rank decomposition into rectangles, and rdh the one into hooks.
+        # If sparse is True, the rank invariant is never stored as a dense
+        # array: ri is instead the list, indexed by the third coordinate, of the
+        # slice differences (indices, values) of rank_invariant_slice_differences,
+        # and rdr and rdh are pairs (indices, values) in coordinate format of
+        # arrays of shape (granularity,) * 4
         if min_k >= max_k:
             raise ValueError("min_k must be smaller than max_k.")
         if min_s >= max_s:
@@ -688,26 +1095,108 @@ class _DegreeRipsBifiltration:
 
         ss = np.linspace(min_s, max_s, granularity)
         ks = np.linspace(min_k, max_k, granularity)[::-1]
+        if sparse:
+            # the rank invariant is in the sparse layout, and the rank
+            # decompositions are in coordinate format
+            ri = self._rank_invariant(
+                ss, ks, n_jobs=n_jobs, reduced=reduced, sparse=True
+            )
+            shape = (granularity, granularity, granularity, granularity)
+            rdr = rank_decomposition_2d_rectangles_sparse(ri, shape)
+            rdh = rank_decomposition_2d_rectangles_to_hooks_sparse(*rdr, shape)
+            return ss, ks, ri, rdr, rdh
         ri = self._rank_invariant(ss, ks, n_jobs=n_jobs, reduced=reduced)
         # need to cast explicitly to int64 for windows compatibility
         rdr = rank_decomposition_2d_rectangles(np.array(ri, dtype=np.int64))
         return ss, ks, ri, rdr, rank_decomposition_2d_rectangles_to_hooks(rdr)
 
-    def _hilbert_function(self, ss, ks, reduced=False, n_jobs=1):
+    def _hilbert_function(self, ss, ks, reduced=False, n_jobs=1, approximate=False):
         n_s = len(ss)
         n_k = len(ks)
         ss = list(ss)
         # go on one more step to compute the Hilbert function at the last point
         ss.append(ss[-1] + _TOL)
         startends = [[[ss[0], k], [ss[-1], k]] for k in ks]
-        pds = self.lambda_linkage_vineyard(startends, reduced=reduced, n_jobs=n_jobs)
+        pds = self.lambda_linkage_vineyard(
+            startends, reduced=reduced, n_jobs=n_jobs, approximate=approximate
+        )
+        # each bar [b, d) of the i-th line adds one to hf[start:end, i], which
+        # is accumulated in a difference array and filled in with a cumsum
+        n_bars = [len(pd) for pd in pds]
+        bars = np.concatenate(
+            [np.asarray(pd, dtype=float).reshape(-1, 2) for pd in pds]
+        )
+        lines = np.repeat(np.arange(n_k), n_bars)
+        start, end = np.searchsorted(ss[:-1], bars.T)
+        hf = np.zeros((n_s + 1, n_k), dtype=int)
+        np.add.at(hf, (start, lines), 1)
+        np.add.at(hf, (end, lines), -1)
+        return np.cumsum(hf, axis=0)[:n_s]
+
+    def _adaptive_hilbert_function(
+        self, ss, ks, max_depth, reduced=False, n_jobs=1, approximate=False
+    ):
+        # approximates the Hilbert function on the grid given by ss and ks by
+        # computing the horizontal lines of a grid that is 2**max_depth times
+        # coarser in the k direction, and then repeatedly bisecting the cells
+        # whose top and bottom lines differ. Since all the values on a
+        # horizontal line are known once its linkage has been computed, the
+        # cells are only split in the k direction. Two lines are considered
+        # equal if they take the same sequence of values as s increases, and
+        # then the lines in between are filled in by interpolating linearly
+        # the values of s at which the value changes.
+        # The result is not a compact mesh: it is a dense grid, which is only
+        # exact on the columns whose linkage has been computed, and whose other
+        # columns are estimates that can be wrong, with no bound on the error.
+        # Lines between two equal lines can still differ from them, so, e.g.,
+        # a component that appears and vanishes between two computed lines is
+        # lost, and the interpolated values of s need not be the exact ones.
+        # Use it only when speed matters more than exactness
+        ks = np.array(ks)
+        n_s = len(ss)
+        n_k = len(ks)
         hf = np.zeros((n_s, n_k), dtype=int)
-        for i, pd in enumerate(pds):
-            for bar in pd:
-                b, d = bar
-                start = np.searchsorted(ss[:-1], b)
-                end = np.searchsorted(ss[:-1], d)
-                hf[start:end, i] += 1
+
+        def _runs(line):
+            # returns the sequence of values and the indices where it changes
+            changes = np.flatnonzero(line[1:] != line[:-1]) + 1
+            return line[np.append(0, changes)], changes
+
+        computed = np.unique(np.append(np.arange(0, n_k, 2**max_depth), n_k - 1))
+        hf[:, computed] = self._hilbert_function(
+            ss, ks[computed], reduced=reduced, n_jobs=n_jobs, approximate=approximate
+        )
+        cells = list(zip(computed[:-1], computed[1:]))
+        while len(cells) > 0:
+            to_split = []
+            for top, bottom in cells:
+                top_values, top_changes = _runs(hf[:, top])
+                bottom_values, bottom_changes = _runs(hf[:, bottom])
+                if np.array_equal(top_values, bottom_values):
+                    for j in range(top + 1, bottom):
+                        t = (j - top) / (bottom - top)
+                        changes = np.rint(
+                            (1 - t) * top_changes + t * bottom_changes
+                        ).astype(int)
+                        hf[:, j] = np.repeat(
+                            top_values, np.diff(np.concatenate([[0], changes, [n_s]]))
+                        )
+                elif bottom - top > 1:
+                    to_split.append((top, bottom))
+            middles = [(top + bottom) // 2 for top, bottom in to_split]
+            if len(middles) > 0:
+                hf[:, middles] = self._hilbert_function(
+                    ss,
+                    ks[middles],
+                    reduced=reduced,
+                    n_jobs=n_jobs,
+                    approximate=approximate,
+                )
+            cells = [
+                cell
+                for (top, bottom), middle in zip(to_split, middles)
+                for cell in [(top, middle), (middle, bottom)]
+            ]
         return hf
 
     def hilbert_function_on_regular_grid(
@@ -719,6 +1208,8 @@ class _DegreeRipsBifiltration:
         granularity,
         reduced=False,
         n_jobs=1,
+        adaptive_depth=0,
+        approximate=False,
     ):
         if min_k >= max_k:
             raise ValueError("min_k must be smaller than max_k.")
@@ -739,9 +1230,84 @@ class _DegreeRipsBifiltration:
 
         ss = np.linspace(min_s, max_s, granularity)
         ks = np.linspace(min_k, max_k, granularity)[::-1]
-        hf = self._hilbert_function(ss, ks, reduced=reduced, n_jobs=n_jobs)
+        # if adaptive_depth > 0, the Hilbert function is only an estimate
+        # between the refined lines (see _adaptive_hilbert_function)
+        if adaptive_depth > 0:
+            hf = self._adaptive_hilbert_function(
+                ss,
+                ks,
+                adaptive_depth,
+                reduced=reduced,
+                n_jobs=n_jobs,
+                approximate=approximate,
+            )
+        else:
+            hf = self._hilbert_function(
+                ss, ks, reduced=reduced, n_jobs=n_jobs, approximate=approximate
+            )
         return ss, ks, hf, signed_betti(hf)
 
+    def hilbert_function_exact(
+        self, min_s, max_s, max_k, min_k, reduced=False, n_jobs=1, approximate=False
+    ):
+        # the core distance of a point with respect to a horizontal line at k
+        # only changes when k crosses one of the values of the kernel estimate
+        # of the point, so the horizontal hierarchical clustering, and hence
+        # the Hilbert function, is constant between consecutive such critical
+        # values. Returns an increasing array ks, starting at min_k and ending
+        # at max_k, and a list of persistence diagrams pds, such that for k in
+        # (ks[i], ks[i+1]] (or in [ks[0], ks[1]], when i = 0) and s in
+        # [min_s, max_s), the Hilbert function at (s, k) is the number of bars
+        # [b, d) of pds[i] with b <= s < d.
+        # One generalized single linkage is computed per distinct critical
+        # value, of which there are up to n_points * n_neighbors when the
+        # measure is not uniform (e.g., for a subsample), so this can be much
+        # more expensive than the Hilbert function on a regular grid; a warning
+        # is given when there are more than _MAX_EXACT_HILBERT_LINES lines
+        if min_k >= max_k:
+            raise ValueError("min_k must be smaller than max_k.")
+        if min_s >= max_s:
+            raise ValueError("min_s must be smaller than max_s.")
+        if max_k > self._mpspace.max_fitted_density():
+            max_k = min(max_k, self._mpspace.max_fitted_density())
+            warnings.warn(
+                "Not enough neighbors to compute chosen max density threshold, using "
+                + str(max_k)
+                + " instead. If needed, re-initialize the Persistable instance with a larger n_neighbors."
+            )
+        if min_k >= max_k:
+            min_k = max_k / 2
+            warnings.warn(
+                "max density threshold too large, using " + str(min_k) + " instead."
+            )
+
+        kernel_estimate = self._mpspace.kernel_estimate()
+        critical_ks = np.unique(
+            kernel_estimate[(kernel_estimate >= min_k) & (kernel_estimate < max_k)]
+        )
+        # each interval is represented by the horizontal line at its right end
+        line_ks = np.append(critical_ks, max_k)
+        if len(line_ks) > _MAX_EXACT_HILBERT_LINES:
+            warnings.warn(
+                "The exact Hilbert function requires "
+                + str(len(line_ks))
+                + " hierarchical clusterings, which may take long; consider using the Hilbert function on a regular grid instead."
+            )
+        startends = [[[min_s, k], [max_s, k]] for k in line_ks]
+        pds = self.lambda_linkage_vineyard(
+            startends, reduced=reduced, n_jobs=n_jobs, approximate=approximate
+        )
+        pds = [np.asarray(pd, dtype=float).reshape(-1, 2) for pd in pds]
+        pds = [pd[np.lexsort(pd.T[::-1])] for pd in pds]
+        # merge consecutive intervals with the same Hilbert function, keeping
+        # the last diagram of each run
+        last_of_run = [
+            not np.array_equal(pd, next_pd) for pd, next_pd in zip(pds[:-1], pds[1:])
+        ] + [True]
+        keep = np.flatnonzero(last_of_run)
+        ks = np.concatenate([[min_k], line_ks[keep]])
+        return ks, [pds[i] for i in keep]
+
 
 class _MetricSpace:
 
@@ -771,8 +1337,26 @@ class _MetricSpace:
         self._dist_mat = None
         self._dist_metric = None
 
+        # idle Boruvka algorithms, which are reused across calls to
+        # generalized_single_linkage, as pairs (number of threads, algorithm);
+        # each one is used by one thread at a time
+        self._boruvka_engines = []
+        self._boruvka_engines_lock = Lock()
+
         self._fit_metric(X, metric, leaf_size, **kwargs)
 
+    def __getstate__(self):
+        # the Boruvka algorithms and the lock cannot be pickled, so processes
+        # receiving a copy of the metric space start with an empty pool
+        state = self.__dict__.copy()
+        state["_boruvka_engines"] = []
+        del state["_boruvka_engines_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._boruvka_engines_lock = Lock()
+
     def _fit_metric(self, X, metric, leaf_size, **kwargs):
         # save point cloud
         self._size = X.shape[0]
@@ -864,7 +1448,46 @@ class _MetricSpace:
     def size(self):
         return self._size
 
-    def generalized_single_linkage(self, core_distances):
+    def _acquire_boruvka_engine(self):
+        # inside the workers of parallel_computation, the Boruvka algorithm
+        # runs in a single thread
+        n_jobs = 1 if _in_parallel_worker() else self._n_jobs
+        with self._boruvka_engines_lock:
+            for i, (engine_n_jobs, engine) in enumerate(self._boruvka_engines):
+                if engine_n_jobs == n_jobs:
+                    del self._boruvka_engines[i]
+                    return n_jobs, engine
+        if self._metric in kdtree_valid_metrics:
+            boruvka_algorithm = KDTreeBoruvkaAlgorithm
+        else:
+            boruvka_algorithm = BallTreeBoruvkaAlgorithm
+        return n_jobs, boruvka_algorithm(
+            self._boruvka_tree,
+            None,
+            self._nn_indices,
+            metric=self._metric,
+            n_jobs=n_jobs,
+            **self._kwargs
+        )
+
+    def _release_boruvka_engine(self, n_jobs, engine):
+        with self._boruvka_engines_lock:
+            self._boruvka_engines.append((n_jobs, engine))
+
+    def _boruvka_spanning_tree(self, core_distances, initial_edges=None):
+        # each thread takes an idle Boruvka algorithm from the pool, or
+        # constructs a new one if there are none, and returns it when done
+        n_jobs, engine = self._acquire_boruvka_engine()
+        try:
+            return engine.spanning_tree(core_distances, initial_edges)
+        finally:
+            self._release_boruvka_engine(n_jobs, engine)
+
+    def generalized_single_linkage(self, core_distances, initial_edges=None):
+        """Single linkage with respect to the mutual reachability distance
+        given by the core distances. If given, ``initial_edges`` is an array
+        of rows ``(i, j, distance)`` forming a forest contained in a minimum
+        spanning tree, which the Boruvka algorithm starts from."""
         if self._metric in kdtree_valid_metrics:
             if self._dimension > self._MAX_DIM_USE_BORUVKA:
                 X = self._points
@@ -872,13 +1495,7 @@ class _MetricSpace:
                     X = np.array(X, dtype=np.double, order="C")
                 sl = mst_linkage_core_vector(X, core_distances, self._dist_metric)
             else:
-                sl = KDTreeBoruvkaAlgorithm(
-                    self._boruvka_tree,
-                    core_distances,
-                    self._nn_indices,
-                    metric=self._metric,
-                    **self._kwargs
-                ).spanning_tree()
+                sl = self._boruvka_spanning_tree(core_distances, initial_edges)
         elif self._metric in balltree_valid_metrics:
             if self._dimension > self._MAX_DIM_USE_BORUVKA:
                 X = self._points
@@ -886,13 +1503,7 @@ class _MetricSpace:
                     X = np.array(X, dtype=np.double, order="C")
                 sl = mst_linkage_core_vector(X, core_distances, self._dist_metric)
             else:
-                sl = BallTreeBoruvkaAlgorithm(
-                    self._boruvka_tree,
-                    core_distances,
-                    self._nn_indices,
-                    metric=self._metric,
-                    **self._kwargs
-                ).spanning_tree()
+                sl = self._boruvka_spanning_tree(core_distances, initial_edges)
         else:
             sl = stepwise_dendrogram_with_core_distances(
                 self.size(), self._dist_mat, core_distances
@@ -904,33 +1515,172 @@ class _MetricSpace:
             core_distances, merges, merges_heights, -np.inf, np.inf
         )
 
-    def hierarchical_clustering_filtered_rips_graph(self, k_births, rips_radius):
+    def approximate_generalized_single_linkage(self, core_distances, n_neighbors=None):
+        """Approximation to generalized_single_linkage, which computes a minimum
+        spanning forest of the mutual reachability graph restricted to the pairs
+        of k-nearest neighbors, and then connects its components exactly.
+        Returns the hierarchical clustering together with an error bound: every
+        merge happens at most error bound later than in the exact hierarchical
+        clustering.
+
+        Only the first n_neighbors neighbors of each point are used, and all of
+        the ones computed in _fit_nn if n_neighbors is None."""
+        if not self._fitted_nn:
+            raise ValueError("Nearest neighbors must be computed first.")
+        if n_neighbors is None:
+            n_neighbors = self._n_neighbors
+        n_neighbors = min(n_neighbors, self._nn_indices.shape[1])
+        core_distances = np.asarray(core_distances, dtype=float)
+        n = self.size()
+
+        sources = np.repeat(np.arange(n), n_neighbors)
+        targets = self._nn_indices[:, :n_neighbors].ravel()
+        weights = np.maximum(
+            self._nn_distance[:, :n_neighbors].ravel(),
+            np.maximum(core_distances[sources], core_distances[targets]),
+        )
+        not_loop = sources != targets
+        sources, targets, weights = (
+            sources[not_loop],
+            targets[not_loop],
+            weights[not_loop],
+        )
+        order = np.argsort(weights, kind="stable")
+        merges, merges_heights = kruskal(
+            n,
+            np.ascontiguousarray(sources[order], dtype=np.intp),
+            np.ascontiguousarray(targets[order], dtype=np.intp),
+            np.ascontiguousarray(weights[order]),
+        )
+
+        # a pair of points that are not each other's neighbors is at distance
+        # at least the distance of either of them to its furthest neighbor, so
+        # every edge missing from the graph has weight at least exact_below,
+        # and the two hierarchical clusterings coincide below this height
+        exact_below = np.min(
+            np.maximum(core_distances, self._nn_distance[:, n_neighbors - 1])
+        )
+
+        # above the largest height of the forest, the components of the forest
+        # are connected in the exact hierarchical clustering, so connecting
+        # them exactly makes both hierarchical clusterings coincide again
+        error_bound = max(0, np.max(merges_heights, initial=-np.inf) - exact_below)
+
+        if merges.shape[0] < n - 1:
+            # connect the components of the forest with the Boruvka algorithm
+            # or, in the dense case, with the exact single linkage
+            if self._metric in kdtree_valid_metrics + balltree_valid_metrics:
+                sl = self._boruvka_spanning_tree(
+                    core_distances,
+                    np.column_stack((merges, merges_heights)),
+                )
+                merges = sl[:, 0:2].astype(int)
+                merges_heights = sl[:, 2]
+            else:
+                return self.generalized_single_linkage(core_distances), 0
+
+        return (
+            _HierarchicalClustering(
+                core_distances, merges, merges_heights, -np.inf, np.inf
+            ),
+            error_bound,
+        )
+
+    def _rips_neighbors(self, points, rips_radius):
+        # returns the pairs (source, target) such that source is in points and
+        # target is at distance at most rips_radius from source
 
         # metric tree case
         if self._metric in kdtree_valid_metrics + balltree_valid_metrics:
-            s_neighbors = self._nn_tree.query_radius(self._points, rips_radius)
+            if self._fitted_nn:
+                # the neighbors within rips_radius of a point whose furthest
+                # fitted neighbor is further than rips_radius are a prefix of
+                # its row of the kNN table, so only the remaining points
+                # need to query the tree
+                nn_distance = self._nn_distance[points]
+                n_within = searchsorted_rows(
+                    nn_distance, rips_radius, side="right", n_threads=_kernel_threads()
+                )
+                fitted = n_within < nn_distance.shape[1]
+                in_prefix = np.arange(nn_distance.shape[1]) < n_within[:, None]
+                in_prefix[~fitted] = False
+                sources = [points[np.nonzero(in_prefix)[0]]]
+                targets = [self._nn_indices[points][in_prefix]]
+                not_fitted = points[~fitted]
+            else:
+                sources = []
+                targets = []
+                not_fitted = points
+            if not_fitted.shape[0] > 0:
+                s_neighbors = self._nn_tree.query_radius(
+                    self._points[not_fitted], rips_radius
+                )
+                sources.append(
+                    np.repeat(
+                        not_fitted, [len(neighbors) for neighbors in s_neighbors]
+                    )
+                )
+                targets.append(np.concatenate(s_neighbors))
+            return np.concatenate(sources), np.concatenate(targets)
         # dense distance matrix case
         elif self._metric == "precomputed":
-            s_neighbors = []
-            for i in range(self.size()):
-                s_neighbors.append(np.argwhere(self._dist_mat[i] <= rips_radius)[:, 0])
+            rows, targets = np.nonzero(self._dist_mat[points] <= rips_radius)
+            return points[rows], targets
         else:
             raise ValueError("Metric given is not supported.")
 
-        edges = []
-        entries = []
-        for i in range(self.size()):
-            for j in s_neighbors[i]:
-                if j > i:
-                    edges.append([i, j])
-                    entries.append(max(k_births[i], k_births[j]))
-        matrix_entries = np.array(entries)
-        edges = np.array(edges, dtype=int)
-        G = FilteredGraph(vertex_values=k_births,
-                          edges=edges,
-                          edge_values=matrix_entries)
-        
-        return G._to_hc()
+    def hierarchical_clustering_filtered_rips_graph(
+        self, k_births, rips_radius, chunk_size=_RIPS_GRAPH_CHUNK_SIZE
+    ):
+        """Hierarchical clustering of the Rips graph at scale rips_radius,
+        where each point is born at its entry of k_births.
+
+        The points are inserted in order of birth, so that every edge is
+        born together with the last of its endpoints to be inserted. The
+        neighbors of chunk_size points are queried at a time and merged with
+        a union-find structure, so that only the edges of one chunk are
+        stored at a time. These are at most chunk_size times the largest
+        number of points within rips_radius of a point, which can be
+        chunk_size * n_points in dense regions. If chunk_size is None, all
+        the points form a single chunk, and the whole Rips graph is stored."""
+        k_births = np.asarray(k_births, dtype=float)
+        n = self.size()
+        if chunk_size is None:
+            chunk_size = max(n, 1)
+
+        insertion_order = np.argsort(k_births, kind="stable")
+        insertion_rank = np.empty(n, dtype=np.intp)
+        insertion_rank[insertion_order] = np.arange(n)
+
+        parent = np.arange(n, dtype=np.intp)
+        rank = np.zeros(n, dtype=np.uint8)
+        merges = []
+        merges_heights = []
+        for chunk_start in range(0, n, chunk_size):
+            points = insertion_order[chunk_start : chunk_start + chunk_size]
+            sources, targets = self._rips_neighbors(points, rips_radius)
+            # each edge is added when its last endpoint is inserted
+            inserted_before = insertion_rank[targets] < insertion_rank[sources]
+            sources = sources[inserted_before]
+            targets = targets[inserted_before]
+            order = np.argsort(insertion_rank[sources], kind="stable")
+            sources = np.ascontiguousarray(sources[order], dtype=np.intp)
+            targets = np.ascontiguousarray(targets[order], dtype=np.intp)
+            chunk_merges, chunk_merges_heights = kruskal(
+                n, sources, targets, k_births[sources], parent, rank
+            )
+            merges.append(chunk_merges)
+            merges_heights.append(chunk_merges_heights)
+
+        if len(merges) == 0:
+            merges = np.zeros((0, 2), dtype=int)
+            merges_heights = np.zeros(0)
+        else:
+            merges = np.concatenate(merges)
+            merges_heights = np.concatenate(merges_heights)
+        return _HierarchicalClustering(
+            k_births, merges, merges_heights, -np.inf, np.inf
+        )
 
     def close_subsample(self, subsample_size, seed=0, euclidean=False):
         """ Returns a pair of arrays with the first array containing the indices \
@@ -1057,16 +1807,16 @@ class _MetricProbabilitySpace(_MetricSpace):
     def density_estimate(self, point_index, radius, max_density=1):
         """ Given a list of point indices and a radius, return the (unnormalized) \
             kernel density estimate at those points and at that radius """
-        density_estimates = []
-        out_of_range = False
-        for p in point_index:
-            if self._kernel_estimate[p, -1] < max_density:
-                out_of_range = True
-            neighbor_idx = np.searchsorted(self._nn_distance[p], radius, side="right")
-            density_estimates.append(self._kernel_estimate[p, neighbor_idx - 1])
-        if out_of_range:
+        point_index = np.asarray(point_index)
+        if np.any(self._kernel_estimate[point_index, -1] < max_density):
             warnings.warn("Don't have enough neighbors to properly compute core scale.")
-        return np.array(density_estimates)
+        neighbor_idx = searchsorted_rows(
+            self._nn_distance[point_index],
+            radius,
+            side="right",
+            n_threads=_kernel_threads(),
+        )
+        return self._kernel_estimate[point_index, neighbor_idx - 1]
 
     def kernel_estimate(self):
         return self._kernel_estimate
@@ -1078,43 +1828,99 @@ class _MetricProbabilitySpace(_MetricSpace):
         return self._maxk
 
 
+class _IncrementalSingleLinkage:
+    """Computes the generalized single linkages of a metric space for a
+    sequence of core distances, such as the ones of consecutive lines of a
+    vineyard, reusing the minimum spanning tree of the previous core distances.
+
+    An edge of the previous minimum spanning tree whose endpoints have the
+    same core distance as before is in a minimum spanning tree for the new
+    core distances provided its distance is at most the new core distance of
+    every point whose core distance decreased, since only the edges incident
+    to these points can have become shorter. The Boruvka algorithm then starts
+    from these edges. If too few edges can be reused, the minimum spanning tree
+    is computed from scratch."""
+
+    # minimum fraction of the edges of the previous minimum spanning tree
+    # that must be reusable in order to start from them
+    _MIN_REUSED_FRACTION = 0.5
+
+    def __init__(self, mspace):
+        self._mspace = mspace
+        self._core_distances = None
+        self._merges = None
+        self._merges_heights = None
+
+    def _reusable_edges(self, core_distances):
+        changed = core_distances != self._core_distances
+        decreased = core_distances < self._core_distances
+        if np.any(decreased):
+            max_distance = np.min(core_distances[decreased])
+        else:
+            max_distance = np.inf
+        keep = (
+            ~changed[self._merges[:, 0]]
+            & ~changed[self._merges[:, 1]]
+            & (self._merges_heights <= max_distance)
+        )
+        return np.column_stack((self._merges[keep], self._merges_heights[keep]))
+
+    def __call__(self, core_distances):
+        core_distances = np.array(core_distances, dtype=float)
+        initial_edges = None
+        if self._core_distances is not None:
+            initial_edges = self._reusable_edges(core_distances)
+            if initial_edges.shape[0] < self._MIN_REUSED_FRACTION * (
+                core_distances.shape[0] - 1
+            ):
+                initial_edges = None
+        hc = self._mspace.generalized_single_linkage(
+            core_distances, initial_edges=initial_edges
+        )
+        self._core_distances = core_distances
+        self._merges = hc._merges.copy()
+        self._merges_heights = hc._merges_heights.copy()
+        return hc
+
+
+class _ApproximateSingleLinkage:
+    """Computes generalized single linkages with
+    approximate_generalized_single_linkage, keeping track of the largest error
+    bound of the hierarchical clusterings it has returned"""
+
+    def __init__(self, mspace):
+        self._mspace = mspace
+        self.error_bound = 0
+
+    def __call__(self, core_distances):
+        hc, error_bound = self._mspace.approximate_generalized_single_linkage(
+            core_distances
+        )
+        self.error_bound = max(self.error_bound, error_bound)
+        return hc
+
+
 class _HierarchicalClustering:
     """Implements a covariant hierarchical clustering"""
 
     def __init__(self, heights, merges, merges_heights, start, end):
         # assumes heights and merges_heights are between start and end
-        self._merges = np.array(merges, dtype=int)
+        self._merges = np.array(merges, dtype=int).reshape(-1, 2)
         self._merges_heights = np.array(merges_heights, dtype=float)
         self._heights = np.array(heights, dtype=float)
         self._start = start
         self._end = end
-        # persistence_diagram_h0 will fail if it receives an empty array
-        if self._merges.shape[0] == 0:
-            # we make the first (zeroth) element merge with itself as soon as it is born
-            self._merges = np.array([[0, 0]], dtype=int)
-            self._merges_heights = np.array([self._heights[0]], dtype=float)
 
     def merges_heights(self):
         return self._merges_heights
     
-    def enforce_monotonic(self):
-        """Enforce monotonicity of the hierarchical clustering"""
-        num_merges = self._merges.shape[0]
-        for i in range(num_merges):
-            x, y = self._merges[i,0], self._merges[i,1]
-            self._merges_heights[i] = max([self._merges_heights[i],
-                                           self._heights[x],
-                                           self._heights[y]])
-
     def snap_to_grid(self, grid):
         def _snap_array(grid, arr):
-            res = np.zeros(arr.shape[0], dtype=int)
-            # assumes grid and arr are ordered smallest to largest
-            res[arr <= grid[0]] = 0
-            for i in range(len(grid) - 1):
-                res[(arr <= grid[i + 1]) & (arr > grid[i])] = i + 1
-            res[arr > grid[-1]] = len(grid) - 1
-            return res
+            # assumes grid is ordered smallest to largest; each value is sent
+            # to the index of the first grid value that is greater than or
+            # equal to it, or to the last index if there is none
+            res = np.searchsorted(grid, arr, side="left")
+            return np.minimum(res, len(grid) - 1).astype(int)
 
         self._merges_heights = _snap_array(grid, self._merges_heights)
         self._heights = _snap_array(grid, self._heights)
@@ -1130,75 +1936,39 @@ class _HierarchicalClustering:
         self._start = start
         self._end = end
 
-    def cut(self, cut_height):
-        end = min(self._end, cut_height)
-        heights = self._heights
-        merges = self._merges
-        merges_heights = self._merges_heights
-        n_points = heights.shape[0]
-        n_merges = merges.shape[0]
-        # this orders the point by appearance
-        appearances = np.argsort(heights)
-        # contains the current clusters
-        uf = DisjointSet()
-        # height index
-        hind = 0
-        # merge index
-        mind = 0
-        current_appearence_height = heights[appearances[0]]
-        current_merge_height = merges_heights[0]
-        while True:
-            # while there is no merge
-            while (
-                hind < n_points
-                and heights[appearances[hind]] <= current_merge_height
-                and heights[appearances[hind]] <= end
-            ):
-                # add all points that are born as new clusters
-                uf.add(appearances[hind])
-                hind += 1
-                if hind == n_points:
-                    current_appearence_height = end
-                else:
-                    current_appearence_height = heights[appearances[hind]]
-            # while there is no cluster being born
-            while (
-                mind < n_merges
-                and merges_heights[mind] < current_appearence_height
-                and merges_heights[mind] <= end
-            ):
-                xy = merges[mind]
-                x, y = xy
-                uf.merge(x, y)
-                mind += 1
-                if mind == n_merges:
-                    current_merge_height = end
-                else:
-                    current_merge_height = merges_heights[mind]
-            if (hind == n_points or heights[appearances[hind]] >= end) and (
-                mind == n_merges or merges_heights[mind] >= end
-            ):
-                break
-        # contains the flat clusters
-        clusters = []
-        # go through all clusters
-        for c in uf.subsets():
-            c = list(c)
-            clusters.append(list(c))
-        current_cluster = 0
-        res = np.full(n_points, -1)
-        for cl in clusters:
-            for x in cl:
-                if x < n_points:
-                    res[x] = current_cluster
-            current_cluster += 1
+    def cuts(self, cut_heights):
+        """Labels of cut for each of the cut heights, in a single sweep"""
+        cut_heights = np.asarray(cut_heights, dtype=float)
+        order = np.argsort(cut_heights, kind="stable")
+        res = np.empty((cut_heights.shape[0], self._heights.shape[0]), dtype=int)
+        res[order] = cuts(
+            self._end,
+            self._heights,
+            # need to cast explicitly to int64 for windows compatibility
+            np.array(self._merges, dtype=np.int64),
+            self._merges_heights,
+            cut_heights[order],
+        )
         return res
+
+    def cut(self, cut_height):
+        return cut(
+            min(self._end, cut_height),
+            self._heights,
+            # need to cast explicitly to int64 for windows compatibility
+            np.array(self._merges, dtype=np.int64),
+            self._merges_heights,
+        )
     
-    def _compute_threshold(self, n_clusters):
+    def _compute_threshold(self, n_clusters, persistence_diagram=None):
         """Compute threshold such that the persistence-based flattening
-        has ``n_clusters`` clusters."""
+        has ``n_clusters`` clusters. The persistence diagram of the
+        hierarchical clustering can be passed if it is already known."""
 
-        bd = self.persistence_diagram()
+        if persistence_diagram is None:
+            bd = self.persistence_diagram()
+        else:
+            bd = persistence_diagram
         pers = np.abs(bd[:, 0] - bd[:, 1])
         # TODO: use sort from largest to smallest and make the logic below simpler
         spers = np.sort(pers)
@@ -1217,6 +1987,9 @@ class _HierarchicalClustering:
 
         return threshold
 
+    def condensed_tree(self):
+        return _CondensedTree(self)
+
     def persistence_based_flattening(
         self, threshold, flattening_mode, keep_low_persistence_clusters
     ):
@@ -1230,217 +2003,92 @@ class _HierarchicalClustering:
     def _tomato_style_persistence_based_flattening(
         self, threshold, keep_low_persistence_clusters
     ):
-        end = self._end
-        heights = self._heights
-        merges = self._merges
-        merges_heights = self._merges_heights
-        n_points = heights.shape[0]
-        n_merges = merges.shape[0]
-        # this orders the point by appearance
-        appearances = np.argsort(heights)
-        # contains the current clusters
-        uf = DisjointSet()
-        # contains the birth time of clusters
-        clusters_birth = np.full(len(heights), -np.inf)
-        # height index
-        hind = 0
-        # merge index
-        mind = 0
-        current_appearence_height = heights[appearances[0]]
-        current_merge_height = merges_heights[0]
-        while True:
-            # while there is no merge
-            while (
-                hind < n_points
-                and heights[appearances[hind]] <= current_merge_height
-                and heights[appearances[hind]] < end
-            ):
-                # add all points that are born as new clusters
-                uf.add(appearances[hind])
-                clusters_birth[appearances[hind]] = heights[appearances[hind]]
-                hind += 1
-                if hind == n_points:
-                    current_appearence_height = end
-                else:
-                    current_appearence_height = heights[appearances[hind]]
-            # while there is no cluster being born
-            while (
-                mind < n_merges
-                and merges_heights[mind] < current_appearence_height
-                and merges_heights[mind] < end
-            ):
-                xy = merges[mind]
-                x, y = xy
-                rx = uf.__getitem__(x)
-                ry = uf.__getitem__(y)
-                bx = clusters_birth[rx]
-                by = clusters_birth[ry]
-                # if one of them has not lived more than the threshold, merge them
-                # otherwise, don't
-                if (
-                    bx + threshold > merges_heights[mind]
-                    or by + threshold > merges_heights[mind]
-                ):
-                    uf.merge(x, y)
-                    rxy = uf.__getitem__(x)
-                    clusters_birth[rxy] = min(bx, by)
-                mind += 1
-                if mind == n_merges:
-                    current_merge_height = end
-                else:
-                    current_merge_height = merges_heights[mind]
-            if (hind == n_points or heights[appearances[hind]] >= end) and (
-                mind == n_merges or merges_heights[mind] >= end
-            ):
-                break
-        # contains the flat clusters
-        clusters = []
-        # go through all clusters
-        for c in uf.subsets():
-            c = list(c)
-            rc = uf.__getitem__(c[0])
-            if (clusters_birth[rc] + threshold <= end) or keep_low_persistence_clusters:
-                clusters.append(list(c))
-        current_cluster = 0
-        res = np.full(n_points, -1)
-        for cl in clusters:
-            for x in cl:
-                if x < n_points:
-                    res[x] = current_cluster
-            current_cluster += 1
-        return res
+        return tomato_style_persistence_based_flattening(
+            self._end,
+            self._heights,
+            # need to cast explicitly to int64 for windows compatibility
+            np.array(self._merges, dtype=np.int64),
+            self._merges_heights,
+            threshold,
+            keep_low_persistence_clusters,
+        )
 
     def _conservative_persistence_based_flattening(self, threshold):
-        end = self._end
-        heights = self._heights
-        merges = self._merges
-        merges_heights = self._merges_heights
-        n_points = heights.shape[0]
-        n_merges = merges.shape[0]
-        # this orders the point by appearance
-        appearances = np.argsort(heights)
-        # contains the current clusters
-        uf = DisjointSet()
-        # contains the birth time of clusters that are alive
-        clusters_birth = {}
-        clusters_died = {}
-        # contains the flat clusters
-        clusters = []
-        # height index
-        hind = 0
-        # merge index
-        mind = 0
-        current_appearence_height = heights[appearances[0]]
-        current_merge_height = merges_heights[0]
-        while True:
-            # while there is no merge
-            while (
-                hind < n_points
-                and heights[appearances[hind]] <= current_merge_height
-                and heights[appearances[hind]] < end
-            ):
-                # add all points that are born as new clusters
-                uf.add(appearances[hind])
-                clusters_birth[appearances[hind]] = heights[appearances[hind]]
-                hind += 1
-                if hind == n_points:
-                    current_appearence_height = end
-                else:
-                    current_appearence_height = heights[appearances[hind]]
-            # while there is no cluster being born
-            while (
-                mind < n_merges
-                and merges_heights[mind] < current_appearence_height
-                and merges_heights[mind] < end
-            ):
-                xy = merges[mind]
-                x, y = xy
-                rx = uf.__getitem__(x)
-                ry = uf.__getitem__(y)
-                # if both clusters are alive
-                if rx not in clusters_died and ry not in clusters_died:
-                    bx = clusters_birth[rx]
-                    by = clusters_birth[ry]
-                    # if both have lived for more than the threshold, have them as flat clusters
-                    if (
-                        bx + threshold <= merges_heights[mind]
-                        and by + threshold <= merges_heights[mind]
-                    ):
-                        clusters.append(list(uf.subset(x)))
-                        clusters.append(list(uf.subset(y)))
-                        uf.merge(x, y)
-                        rxy = uf.__getitem__(x)
-                        clusters_died[rxy] = True
-                    # otherwise, merge them
-                    else:
-                        # then merge them
-                        del clusters_birth[rx]
-                        del clusters_birth[ry]
-                        uf.merge(x, y)
-                        rxy = uf.__getitem__(x)
-                        clusters_birth[rxy] = min(bx, by)
-                # if both clusters are already dead, just merge them into a dead cluster
-                elif rx in clusters_died and ry in clusters_died:
-                    uf.merge(x, y)
-                    rxy = uf.__getitem__(x)
-                    clusters_died[rxy] = True
-                # if only one of them is dead
-                else:
-                    # we make it so that ry already died and rx just died
-                    if rx in clusters_died:
-                        x, y = y, x
-                        rx, ry = ry, rx
-                    # if x has lived for longer than the threshold, have it as a flat cluster
-                    if clusters_birth[rx] + threshold <= merges_heights[mind]:
-                        clusters.append(list(uf.subset(x)))
-                    # then merge the clusters into a dead cluster
-                    uf.merge(x, y)
-                    rxy = uf.__getitem__(x)
-                    clusters_died[rxy] = True
-                mind += 1
-                if mind == n_merges:
-                    current_merge_height = end
-                else:
-                    current_merge_height = merges_heights[mind]
-            if (hind == n_points or heights[appearances[hind]] >= end) and (
-                mind == n_merges or merges_heights[mind] >= end
-            ):
-                break
-        # go through all clusters that have been born but haven't been merged
-        for x in range(n_points):
-            if x in uf._indices:
-                rx = uf.__getitem__(x)
-                if rx not in clusters_died:
-                    if clusters_birth[rx] + threshold <= end:
-                        clusters.append(list(uf.subset(x)))
-                    clusters_died[rx] = True
-        current_cluster = 0
-        res = np.full(n_points, -1)
-        for cl in clusters:
-            for x in cl:
-                if x < n_points:
-                    res[x] = current_cluster
-            current_cluster += 1
-        return res
+        return conservative_persistence_based_flattening(
+            self._end,
+            self._heights,
+            # need to cast explicitly to int64 for windows compatibility
+            np.array(self._merges, dtype=np.int64),
+            self._merges_heights,
+            threshold,
+        )
 
     def persistence_diagram(self, reduced=False, tol=_TOL):
-        pd = persistence_diagram_h0(
+        return persistence_diagram_h0(
             self._end,
             self._heights,
             # need to cast explicitly to int64 for windows compatibility
             np.array(self._merges, dtype=np.int64),
             self._merges_heights,
+            tol=tol,
+            reduced=reduced,
         )
-        pd = np.array(pd)
-        if pd.shape[0] == 0:
-            return np.array([])
-        pd = pd[np.abs(pd[:, 0] - pd[:, 1]) > tol]
-        if reduced:
-            to_delete = np.argmax(pd[:, 1] - pd[:, 0])
-            return np.delete(pd, to_delete, axis=0)
-        return pd
     
 
+class _CondensedTree:
+    """Tree of the clusters of a hierarchical clustering, with the birth and
+    death of each cluster, and with the points stored in an order in which the
+    members of each cluster are contiguous. It is computed once, after which
+    the conservative persistence-based flattening for any threshold takes a
+    single pass over the tree, labeling each flat cluster with a slice."""
+
+    def __init__(self, hc):
+        self._hc = hc
+        (
+            self._order,
+            self._births,
+            self._deaths,
+            self._starts,
+            self._sizes,
+            self._children,
+            self._roots,
+        ) = condensed_tree(
+            hc._end,
+            hc._heights,
+            # need to cast explicitly to int64 for windows compatibility
+            np.array(hc._merges, dtype=np.int64),
+            hc._merges_heights,
+        )
+        self._persistence_diagram = None
+
+    def _compute_threshold(self, n_clusters):
+        if self._persistence_diagram is None:
+            self._persistence_diagram = self._hc.persistence_diagram()
+        return self._hc._compute_threshold(n_clusters, self._persistence_diagram)
+
+    def persistence_based_flattening(
+        self, threshold, flattening_mode, keep_low_persistence_clusters
+    ):
+        if flattening_mode == "conservative":
+            return condensed_tree_conservative_flattening(
+                self._hc._heights.shape[0],
+                self._order,
+                self._births,
+                self._deaths,
+                self._starts,
+                self._sizes,
+                self._children,
+                self._roots,
+                threshold,
+            )
+        else:
+            # the clusters of the tomato-style flattening are not necessarily
+            # clusters of the tree, so they are computed from the merges
+            return self._hc._tomato_style_persistence_based_flattening(
+                threshold, keep_low_persistence_clusters
+            )
+
+
 class FilteredGraph:
     """Implements a one-parameter filtered graph. The vertices and edges of the
     graph should have scalar filtration values such that, if ``(i,j)`` is an
@@ -1478,45 +2126,26 @@ class FilteredGraph:
 
     def _to_hc(self):
 
-        if self.edges.shape[0] > 0:
-            # shift edge weights to be strictly positive before computing mst
-            # as scipy sparse matrix mst implementation treats
-            # edges with weight zero as not there
-            if (min_weight := np.amin(self.edge_values)) < 0:
-                shift = np.abs(min_weight) + 1
-            else:
-                shift = 1
-            shifted_edge_values = self.edge_values + shift
-
-            matrix = csr_matrix(
-                    (shifted_edge_values, (self.edges[:, 0], self.edges[:, 1])), 
-                    (self.num_vertices, self.num_vertices)
-                )
-            mst = sparse_matrix_minimum_spanning_tree(matrix)
-            Is, Js = mst.nonzero()
-            # we now undo the shift
-            vals = np.array(mst[Is, Js])[0] - shift
-            sort_indices = np.argsort(vals)
-            Is = Is[sort_indices]
-            Js = Js[sort_indices]
-            vals = vals[sort_indices]
-            merges = np.zeros((vals.shape[0], 2), dtype=int)
-            merges[:, 0] = Is
-            merges[:, 1] = Js
-            merges_heights = vals
-        else:
-            merges = np.array([], dtype=int)
-            merges_heights = np.array([])
-
-        hc = _HierarchicalClustering(
-            self.vertex_values, merges, merges_heights, 
-            self.start, self.end
+        edges = np.asarray(self.edges, dtype=np.intp).reshape(-1, 2)
+        vertex_values = np.asarray(self.vertex_values, dtype=float)
+        # for numerical reasons, it's possible that an edge appears before
+        # one of its vertices, so edges are delayed until both vertices are
+        # born, which makes the merges monotonic
+        edge_values = np.maximum(
+            np.asarray(self.edge_values, dtype=float),
+            np.maximum(vertex_values[edges[:, 0]], vertex_values[edges[:, 1]]),
+        )
+        order = np.argsort(edge_values, kind="stable")
+        merges, merges_heights = kruskal(
+            self.num_vertices,
+            np.ascontiguousarray(edges[order, 0]),
+            np.ascontiguousarray(edges[order, 1]),
+            np.ascontiguousarray(edge_values[order]),
         )
 
-        # for numerical reasons, it's possible that a vertex will be merged
-        # before it's born
-        hc.enforce_monotonic()
-        return hc
+        return _HierarchicalClustering(
+            self.vertex_values, merges, merges_heights, self.start, self.end
+        )
     
     def persistence_diagram(self):
         """Compute the persistence diagram of the filtered graph"""
@@ -73,6 +73,7 @@ MIN_GRANULARITY_VINEYARD = "min-granularity-vineyard-"
 MAX_GRANULARITY_VINEYARD = "max-granularity-vineyard-"
 GRANULARITY_RI = "granularity-ri-"
 NUM_JOBS_CCF = "num-jobs-ccf-"
+ADAPTIVE_CCF = "adaptive-ccf-"
 NUM_JOBS_RI = "num-jobs-ri-"
 MAX_COMPONENTS = "max-components-"
 MAX_RI = "max-ri-"
@@ -157,7 +158,7 @@ def compute_defaults(end, default_granularity):
     bounds = {
         MIN_GRANULARITY: 2,
         MAX_GRANULARITY: 512,
-        MAX_GRANULARITY_RI: 64,
+        MAX_GRANULARITY_RI: 256,
         MIN_GRANULARITY_VINEYARD: 1,
         MAX_GRANULARITY_VINEYARD: 512,
     }
@@ -502,6 +503,24 @@ class PersistableInteractive:
                                     ),
                                 ],
                             ),
+                            html.Div(
+                                className="parameter-single",
+                                children=[
+                                    html.Span(
+                                        className="name",
+                                        children="Adaptive grid (approx.)",
+                                    ),
+                                    dcc.RadioItems(
+                                        [
+                                            "Yes",
+                                            "No",
+                                        ],
+                                        "No",
+                                        id=ADAPTIVE_CCF,
+                                        className="small-value",
+                                    ),
+                                ],
+                            ),
                         ],
                     ),
                 ],
@@ -2270,6 +2289,7 @@ class PersistableInteractive:
                 [MAX_DIST_SCALE, VALUE, ST],
                 [GRANULARITY, VALUE, ST],
                 [NUM_JOBS_CCF, VALUE, ST],
+                [ADAPTIVE_CCF, VALUE, ST],
             ],
             [
                 [STORED_CCF, DATA],
@@ -2306,6 +2326,14 @@ class PersistableInteractive:
             with warnings.catch_warnings(record=True) as w:
                 warnings.simplefilter("always")
                 try:
+                    # if the user opts in, lines are only computed on a grid of
+                    # granularity about 64, which is then refined where needed,
+                    # and the Hilbert function in between is only approximate
+                    adaptive_depth = 0
+                    if d[ADAPTIVE_CCF + VALUE] == "Yes":
+                        adaptive_depth = max(
+                            0, int(np.ceil(np.log2((granularity - 1) / 64)))
+                        )
                     ss, ks, hf, bn = persistable._hilbert_function(
                         d[MIN_DIST_SCALE + VALUE],
                         d[MAX_DIST_SCALE + VALUE],
@@ -2313,6 +2341,7 @@ class PersistableInteractive:
                         d[MIN_DENSITY_THRESHOLD + VALUE],
                         granularity,
                         n_jobs=num_jobs,
+                        adaptive_depth=adaptive_depth,
                     )
 
                 except ValueError:
@@ -2387,25 +2416,19 @@ class PersistableInteractive:
                         granularity,
                         reduced=reduced,
                         n_jobs=num_jobs,
+                        sparse=True,
                     )
 
-                    lx = sbr.shape[0]
-                    ly = sbr.shape[1]
+                    # the signed barcodes are in coordinate format
                     sbr = [
-                        [i, j, i_, j_, int(sbr[i, j, i_, j_])]
-                        for i in range(lx)
-                        for j in range(ly)
-                        for i_ in range(i, lx)
-                        for j_ in range(j, ly)
-                        if sbr[i, j, i_, j_] != 0
+                        [i, j, i_, j_, int(v)]
+                        for (i, j, i_, j_), v in zip(sbr[0].tolist(), sbr[1])
+                        if i_ >= i and j_ >= j
                     ]
                     sbh = [
-                        [i, j, i_, j_, int(sbh[i, j, i_, j_])]
-                        for i in range(lx)
-                        for j in range(ly)
-                        for i_ in range(i, lx)
-                        for j_ in range(j, ly)
-                        if sbh[i, j, i_, j_] != 0
+                        [i, j, i_, j_, int(v)]
+                        for (i, j, i_, j_), v in zip(sbh[0].tolist(), sbh[1])
+                        if i_ >= i and j_ >= j
                     ]
                 except ValueError:
                     out += traceback.format_exc()
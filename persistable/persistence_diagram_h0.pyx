@@ -13,108 +13,257 @@ import numpy as np
 cimport numpy as np
 ctypedef np.uint8_t uint8
 
-from borrowed._hdbscan_boruvka cimport BoruvkaUnionFind
+from cython.parallel cimport prange
+from libc.math cimport fabs
 
 
-cpdef persistence_diagram_h0(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights):
-    cdef np.int64_t n_points = heights.shape[0]
-    cdef np.int64_t n_merges = merges.shape[0]
-    # this orders the point by appearance
-    cdef np.int64_t[:] appearances = np.argsort(heights)
-    # contains the current clusters
-    cdef BoruvkaUnionFind uf = BoruvkaUnionFind(len(heights))
-    # contains the birth time of clusters that are alive
-    cdef double[:] clusters_birth = np.full(n_points, -1, dtype=float)
-    cdef uint8[:] clusters_died = np.zeros(n_points, dtype=np.uint8)
-    # contains the persistence diagram
-    cdef list pd = []
+cdef inline np.int64_t _find(np.intp_t[::1] parent, np.int64_t x) nogil:
+    # find with path halving
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+cdef inline np.int64_t _union(np.intp_t[::1] parent, uint8[::1] rank, np.int64_t rx, np.int64_t ry) nogil:
+    # union by rank of two roots, returns the root of the union
+    if rank[rx] < rank[ry]:
+        parent[rx] = ry
+        return ry
+    parent[ry] = rx
+    if rank[rx] == rank[ry]:
+        rank[rx] += 1
+    return rx
+
+
+cdef np.int64_t _persistence_diagram_h0(
+    double end,
+    const double[:] heights,
+    const np.int64_t[:] appearances,
+    np.int64_t p0,
+    np.int64_t n_points,
+    const np.int64_t[:,:] merges,
+    const double[:] merges_heights,
+    np.int64_t m0,
+    np.int64_t n_merges,
+    double tol,
+    bint reduced,
+    np.intp_t[::1] parent,
+    uint8[::1] rank,
+    double[::1] clusters_birth,
+    uint8[::1] clusters_died,
+    double[:, ::1] pd,
+) nogil:
+    # computes the persistence diagram of the hierarchical clustering given by
+    # the points p0, ..., p0 + n_points - 1 and the merges m0, ..., m0 + n_merges - 1,
+    # whose indices are relative to p0, as are the appearances; all the work
+    # arrays are indexed by p0 + the index of the point, and the bars are
+    # written in the rows p0, ... of pd. Returns the number of bars kept, or
+    # -1 if there are no bars at all
+    cdef np.int64_t n_bars = 0
+    cdef np.int64_t n_kept
+    cdef np.int64_t i
+    cdef np.int64_t longest
     # height index
     cdef np.int64_t hind = 0
     # merge index
     cdef np.int64_t mind = 0
-    if len(appearances) == 0:
-        return []
-
-    cdef double current_appearence_height = heights[appearances[0]]
+    cdef double current_appearence_height
     cdef double current_merge_height
-    cdef np.int64_t[:] xy
     cdef np.int64_t x
-    cdef np.int64_t y
     cdef np.int64_t rx
     cdef np.int64_t ry
+    cdef np.int64_t rxy
     cdef double bx
     cdef double by
-    cdef double elder_birth
-    cdef double younger_birth
-    cdef np.int64_t to_delete
 
-    if len(merges_heights) == 0:
+    if n_points == 0:
+        return -1
+    for i in range(n_points):
+        parent[p0 + i] = i
+        rank[p0 + i] = 0
+        # contains the birth time of clusters that are alive
+        clusters_birth[p0 + i] = -1
+        clusters_died[p0 + i] = False
+    # the union-find works on indices relative to p0
+    parent = parent[p0:p0 + n_points]
+    rank = rank[p0:p0 + n_points]
+
+    current_appearence_height = heights[p0 + appearances[p0]]
+    if n_merges == 0:
         current_merge_height = end
     else:
-        current_merge_height = merges_heights[0]
+        current_merge_height = merges_heights[m0]
     while True:
         # while there is no merge
         while (
             hind < n_points
-            and heights[appearances[hind]] <= current_merge_height
-            and heights[appearances[hind]] < end
+            and heights[p0 + appearances[p0 + hind]] <= current_merge_height
+            and heights[p0 + appearances[p0 + hind]] < end
         ):
             # add all points that are born as new clusters
-            clusters_birth[uf.find(appearances[hind])] = heights[appearances[hind]]
+            x = appearances[p0 + hind]
+            clusters_birth[p0 + _find(parent, x)] = heights[p0 + x]
             hind += 1
             if hind == n_points:
                 current_appearence_height = end
             else:
-                current_appearence_height = heights[appearances[hind]]
+                current_appearence_height = heights[p0 + appearances[p0 + hind]]
         # while there is no cluster being born
         while (
             mind < n_merges
-            and merges_heights[mind] < current_appearence_height
-            and merges_heights[mind] < end
+            and merges_heights[m0 + mind] < current_appearence_height
+            and merges_heights[m0 + mind] < end
         ):
-            xy = merges[mind]
-            x, y = xy
-            rx = uf.find(x)
-            ry = uf.find(y)
+            rx = _find(parent, merges[m0 + mind, 0])
+            ry = _find(parent, merges[m0 + mind, 1])
             # if they were not already merged
             if rx != ry:
                 # if both clusters are alive, merge them and add a bar to the pd
-                if not clusters_died[rx] and not clusters_died[ry]:
-                    bx = clusters_birth[rx]
-                    by = clusters_birth[ry]
-                    elder_birth, younger_birth = min(bx, by), max(bx, by)
-                    pd.append([younger_birth, merges_heights[mind]])
-                    uf.union_(x, y)
-                    rxy = uf.find(x)
-                    clusters_birth[rxy] = elder_birth
-                # if both clusters are already dead, just merge them into a dead cluster
-                elif clusters_died[rx] and clusters_died[ry]:
-                    uf.union_(x, y)
-                    rxy = uf.find(x)
-                    clusters_died[rxy] = True
-                # if only one of them is dead
+                if not clusters_died[p0 + rx] and not clusters_died[p0 + ry]:
+                    bx = clusters_birth[p0 + rx]
+                    by = clusters_birth[p0 + ry]
+                    pd[p0 + n_bars, 0] = max(bx, by)
+                    pd[p0 + n_bars, 1] = merges_heights[m0 + mind]
+                    n_bars += 1
+                    rxy = _union(parent, rank, rx, ry)
+                    clusters_birth[p0 + rxy] = min(bx, by)
+                # if at least one of them is dead, merge them into a dead cluster
                 else:
-                    # we make it so that ry already died and rx just died
-                    if clusters_died[rx]:
-                        x, y = y, x
-                        rx, ry = ry, rx
-                    # merge the clusters into a dead cluster
-                    uf.union_(x, y)
-                    rxy = uf.find(x)
-                    clusters_died[rxy] = True
+                    rxy = _union(parent, rank, rx, ry)
+                    clusters_died[p0 + rxy] = True
             mind += 1
             if mind == n_merges:
                 current_merge_height = end
             else:
-                current_merge_height = merges_heights[mind]
-        if (hind == n_points or heights[appearances[hind]] >= end) and (
-            mind == n_merges or merges_heights[mind] >= end
+                current_merge_height = merges_heights[m0 + mind]
+        if (hind == n_points or heights[p0 + appearances[p0 + hind]] >= end) and (
+            mind == n_merges or merges_heights[m0 + mind] >= end
         ):
             break
-    # go through all clusters that have been born but haven't died 
+    # go through all clusters that have been born but haven't died
     for x in range(n_points):
-        rx = uf.find(x)
-        if (clusters_birth[rx] != -1) and (not clusters_died[rx]):
-            pd.append([clusters_birth[rx], end])
-            clusters_died[rx] = True
-    return pd
+        rx = _find(parent, x)
+        if (clusters_birth[p0 + rx] != -1) and (not clusters_died[p0 + rx]):
+            pd[p0 + n_bars, 0] = clusters_birth[p0 + rx]
+            pd[p0 + n_bars, 1] = end
+            n_bars += 1
+            clusters_died[p0 + rx] = True
+    if n_bars == 0:
+        return -1
+    # keep the bars that are longer than tol
+    n_kept = 0
+    for i in range(p0, p0 + n_bars):
+        if fabs(pd[i, 0] - pd[i, 1]) > tol:
+            pd[p0 + n_kept, 0] = pd[i, 0]
+            pd[p0 + n_kept, 1] = pd[i, 1]
+            n_kept += 1
+    # delete the first of the longest bars
+    if reduced and n_kept > 0:
+        longest = p0
+        for i in range(p0 + 1, p0 + n_kept):
+            if pd[i, 1] - pd[i, 0] > pd[longest, 1] - pd[longest, 0]:
+                longest = i
+        for i in range(longest, p0 + n_kept - 1):
+            pd[i, 0] = pd[i + 1, 0]
+            pd[i, 1] = pd[i + 1, 1]
+        n_kept -= 1
+    return n_kept
+
+
+cpdef np.ndarray persistence_diagram_h0(double end, double[:] heights, np.int64_t[:,:] merges, double[:] merges_heights, double tol=-1, bint reduced=False):
+    # returns the bars as the rows of a view of an array of shape (n_points, 2),
+    # since there is at most one bar per point, discarding the bars of length
+    # at most tol, and also the longest one if reduced is True; returns an
+    # empty array if there are no bars at all
+    cdef np.int64_t n_points = heights.shape[0]
+    # this orders the point by appearance
+    cdef np.int64_t[:] appearances = np.argsort(heights).astype(np.int64)
+    pd = np.empty((n_points, 2), dtype=float)
+    cdef np.int64_t n_kept = _persistence_diagram_h0(
+        end,
+        heights,
+        appearances,
+        0,
+        n_points,
+        merges,
+        merges_heights,
+        0,
+        merges.shape[0],
+        tol,
+        reduced,
+        np.empty(n_points, dtype=np.intp),
+        np.empty(n_points, dtype=np.uint8),
+        np.empty(n_points, dtype=float),
+        np.empty(n_points, dtype=np.uint8),
+        pd,
+    )
+    if n_kept == -1:
+        return np.array([])
+    return pd[:n_kept]
+
+
+def persistence_diagrams_h0(
+    const double[:] ends,
+    const np.int64_t[:] point_offsets,
+    const double[:] heights,
+    const np.int64_t[:] merge_offsets,
+    const np.int64_t[:,:] merges,
+    const double[:] merges_heights,
+    double tol=-1,
+    bint reduced=False,
+    int n_threads=1,
+):
+    # computes the persistence diagrams of many hierarchical clusterings at
+    # once; the i-th clustering consists of the heights between point_offsets[i]
+    # and point_offsets[i+1] and of the merges (and heights of merges) between
+    # merge_offsets[i] and merge_offsets[i+1], where the indices of the merges
+    # are relative to the first point of the clustering. Returns the bars of all
+    # the diagrams concatenated, as an array of shape (n_bars, 2), together with
+    # the offsets of the diagrams in it, so that the i-th diagram is
+    # bars[offsets[i]:offsets[i+1]]
+    cdef np.int64_t n_diagrams = ends.shape[0]
+    cdef np.int64_t n_points = heights.shape[0]
+    cdef np.int64_t d
+    cdef np.int64_t n_kept
+    sizes = np.diff(point_offsets)
+    starts = np.repeat(np.asarray(point_offsets)[:n_diagrams], sizes)
+    # this orders the points of each clustering by appearance, relative to the
+    # first point of the clustering
+    cdef np.int64_t[:] appearances = (
+        np.lexsort((heights, np.repeat(np.arange(n_diagrams), sizes))) - starts
+    ).astype(np.int64)
+    cdef np.intp_t[::1] parent = np.empty(n_points, dtype=np.intp)
+    cdef uint8[::1] rank = np.empty(n_points, dtype=np.uint8)
+    cdef double[::1] clusters_birth = np.empty(n_points, dtype=float)
+    cdef uint8[::1] clusters_died = np.empty(n_points, dtype=np.uint8)
+    pd = np.empty((n_points, 2), dtype=float)
+    cdef double[:, ::1] pd_view = pd
+    counts = np.empty(n_diagrams, dtype=np.int64)
+    cdef np.int64_t[::1] counts_view = counts
+    with nogil:
+        for d in prange(n_diagrams, schedule="dynamic", num_threads=n_threads):
+            n_kept = _persistence_diagram_h0(
+                ends[d],
+                heights,
+                appearances,
+                point_offsets[d],
+                point_offsets[d + 1] - point_offsets[d],
+                merges,
+                merges_heights,
+                merge_offsets[d],
+                merge_offsets[d + 1] - merge_offsets[d],
+                tol,
+                reduced,
+                parent,
+                rank,
+                clusters_birth,
+                clusters_died,
+                pd_view,
+            )
+            counts_view[d] = max(n_kept, 0)
+    offsets = np.zeros(n_diagrams + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # the bars of each diagram are at the beginning of its block of rows
+    keep = np.arange(n_points) - starts < np.repeat(counts, sizes)
+    return offsets, pd[keep]
@@ -29,17 +29,125 @@ cpdef rank_decomposition_2d_rectangles(np.int64_t[:,:,:,:] rank_invariant):
     return np.flip(signed_betti(np.flip(rank_invariant,(2,3))),(2,3))
 
 cpdef rank_decomposition_2d_rectangles_to_hooks(np.int64_t[:,:,:,:] rdr):
-    cdef np.int64_t[:,:,:,:] rdr_view = rdr
-    rdh = np.zeros_like(rdr, dtype=np.int64)
-    cdef np.int64_t[:,:,:,:] rdh_view = rdh
-    cdef int i, j, i_, j_
-    for i in range(rdr.shape[0]):
-        for j in range(rdr.shape[1]):
-            for i_ in range(i, rdr.shape[2]):
-                for j_ in range(j, rdr.shape[3]):
-                    up_i = min(i_+1,rdr.shape[0] - 1)
-                    up_j = min(j_+1,rdr.shape[1] - 1)
-                    rdh_view[i,j,up_i,up_j] -= rdr_view[i,j,i_,j_]
-                    rdh_view[i,j,up_i,j] += rdr_view[i,j,i_,j_]
-                    rdh_view[i,j,i,up_j] += rdr_view[i,j,i_,j_]
+    # only the nonzero rectangles contribute to the hooks
+    rdr_array = np.asarray(rdr)
+    nonzero = np.flatnonzero(rdr_array)
+    indices = np.stack(np.unravel_index(nonzero, rdr_array.shape), axis=1)
+    hooks_indices, hooks_values = _hooks_of_rectangles(
+        indices, rdr_array.ravel()[nonzero], rdr_array.shape
+    )
+    rdh = np.zeros(rdr_array.shape, dtype=np.int64)
+    np.add.at(rdh, tuple(hooks_indices.T), hooks_values)
     return rdh
+
+
+# Sparse layout: an array with many zeros is stored in coordinate format, as a
+# pair (indices, values), where indices is an integer array of shape
+# (nnz, number of dimensions) sorted lexicographically, and values contains
+# the corresponding nonzero entries.
+# The rank invariant is stored as the list of the finite differences of its
+# slices ri[:, :, i_, :] (see rank_invariant_slice_differences), which are
+# sparse since each bar only contributes to the corners of rectangles, and
+# from which the rank decomposition can be computed directly.
+
+
+def _sum_duplicates(indices, values, shape):
+    # sums the values of repeated indices of an array in coordinate format,
+    # and drops the entries that become zero
+    linear = np.ravel_multi_index(tuple(indices.T), shape)
+    linear, inverse = np.unique(linear, return_inverse=True)
+    summed = np.zeros(len(linear), dtype=np.int64)
+    np.add.at(summed, inverse, values)
+    nonzero = summed != 0
+    indices = np.array(np.unravel_index(linear[nonzero], shape), dtype=np.int64)
+    return indices.T.reshape(-1, len(shape)), summed[nonzero]
+
+
+cpdef rank_invariant_slice_differences(ri_slice):
+    # returns, in coordinate format, the alternating sum of the 8 shifts of
+    # the slice ri[:, :, i_, :] of a rank invariant that appear in
+    # rank_decomposition_2d_rectangles; the slice rdr[:, :, i_, :] is then the
+    # difference of the ones of the slices i_ and i_ + 1
+    n0, n1, n3 = ri_slice.shape
+    padded = np.zeros((n0 + 1, n1 + 1, n3 + 1), dtype=np.int64)
+    padded[1:, 1:, :-1] = ri_slice
+    diff = np.diff(np.diff(padded, axis=0), axis=1)
+    diff = diff[:, :, :-1] - diff[:, :, 1:]
+    indices = np.array(np.nonzero(diff), dtype=np.int64).T.reshape(-1, 3)
+    return indices, diff[tuple(indices.T)]
+
+
+cpdef rank_invariant_slice_differences_of_boxes(a_starts, a_ends, ks, j_starts, j_ends, shape):
+    # same as rank_invariant_slice_differences, for the slice of the given
+    # shape that is the sum of the indicators of the boxes
+    # [a_starts, a_ends) x {ks} x [j_starts, j_ends), which is never built:
+    # each box only contributes to the differences at its 8 corners, so the
+    # cost only depends on the number of boxes
+    n0, n1, n3 = shape
+    a_starts = np.asarray(a_starts, dtype=np.int64)
+    a_ends = np.minimum(np.asarray(a_ends, dtype=np.int64), n0)
+    ks = np.asarray(ks, dtype=np.int64)
+    j_starts = np.asarray(j_starts, dtype=np.int64)
+    j_ends = np.minimum(np.asarray(j_ends, dtype=np.int64), n3)
+    nonempty = (a_starts < a_ends) & (j_starts < j_ends)
+    a_starts = a_starts[nonempty]
+    a_ends = a_ends[nonempty]
+    ks = ks[nonempty]
+    j_starts = j_starts[nonempty]
+    j_ends = j_ends[nonempty]
+    corners = [
+        [(a_starts, 1), (a_ends, -1)],
+        [(ks, 1), (ks + 1, -1)],
+        [(j_ends - 1, 1), (j_starts - 1, -1)],
+    ]
+    indices = []
+    values = []
+    for (a, sa), (k, sk), (j, sj) in itertools.product(*corners):
+        inside = (a < n0) & (k < n1) & (j >= 0)
+        indices.append(np.stack([a[inside], k[inside], j[inside]], axis=1))
+        values.append(np.full(np.count_nonzero(inside), sa * sk * sj, dtype=np.int64))
+    return _sum_duplicates(np.concatenate(indices), np.concatenate(values), shape)
+
+
+cpdef rank_decomposition_2d_rectangles_sparse(slices_differences, shape):
+    # same as rank_decomposition_2d_rectangles, but takes a rank invariant of
+    # the given shape in the sparse layout, and returns the rank decomposition
+    # in coordinate format
+    indices = []
+    values = []
+    for i_, (slice_indices, slice_values) in enumerate(slices_differences):
+        for target, sign in [(i_, 1), (i_ - 1, -1)]:
+            if target >= 0:
+                indices.append(np.insert(slice_indices, 2, target, axis=1))
+                values.append(sign * slice_values)
+    if len(indices) == 0:
+        return np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return _sum_duplicates(np.concatenate(indices), np.concatenate(values), shape)
+
+
+def _hooks_of_rectangles(indices, values, shape):
+    # each rectangle [i, i_] x [j, j_] with i <= i_ and j <= j_ is the
+    # alternating sum of three hooks, which are returned in coordinate format,
+    # possibly with repeated indices
+    upper = (indices[:, 2] >= indices[:, 0]) & (indices[:, 3] >= indices[:, 1])
+    i, j, i_, j_ = indices[upper].T
+    values = values[upper]
+    up_i = np.minimum(i_ + 1, shape[0] - 1)
+    up_j = np.minimum(j_ + 1, shape[1] - 1)
+    hooks_indices = np.concatenate(
+        [
+            np.stack([i, j, up_i, up_j], axis=1),
+            np.stack([i, j, up_i, j], axis=1),
+            np.stack([i, j, i, up_j], axis=1),
+        ]
+    )
+    hooks_values = np.concatenate([-values, values, values])
+    return hooks_indices, hooks_values
+
+
+cpdef rank_decomposition_2d_rectangles_to_hooks_sparse(indices, values, shape):
+    # same as rank_decomposition_2d_rectangles_to_hooks, but takes and returns
+    # arrays of the given shape in coordinate format, so that its cost only
+    # depends on the number of nonzero rectangles
+    hooks_indices, hooks_values = _hooks_of_rectangles(indices, values, shape)
+    return _sum_duplicates(hooks_indices, hooks_values, shape)
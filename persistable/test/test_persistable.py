@@ -1,11 +1,32 @@
 # Authors: Luis Scoccola
 # License: 3-clause BSD
 
+import os
+import tempfile
 import unittest
+from unittest import mock
+import warnings
 from persistable import Persistable, FilteredGraph
-from persistable.persistable import _HierarchicalClustering, _MetricSpace
-from persistable.signed_betti_numbers import signed_betti
+from persistable.persistable import (
+    _HierarchicalClustering,
+    _MetricSpace,
+    _IncrementalSingleLinkage,
+    _persistence_diagrams,
+    _kernel_threads,
+    parallel_computation,
+)
+from joblib.parallel import cpu_count
+from persistable.signed_betti_numbers import (
+    signed_betti,
+    rank_decomposition_2d_rectangles_to_hooks,
+    rank_decomposition_2d_rectangles_to_hooks_sparse,
+    rank_invariant_slice_differences,
+    rank_invariant_slice_differences_of_boxes,
+)
+from persistable.auxiliary import searchsorted_rows, kruskal, lazy_intersections
 from scipy.spatial import distance_matrix
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
 from scipy.spatial.distance import cdist
 from sklearn import datasets
 from sklearn.datasets import make_blobs
@@ -90,6 +111,30 @@ class TestDegreeRipsBifiltration(unittest.TestCase):
                             bf2._core_distance(np.arange(self._n), s0, k0),
                         )
 
+    def test_core_distances_of_lines(self):
+        """ Check that the core distances of many lines computed at once \
+            coincide with the core distances of each line """
+        p = Persistable(self._X)
+        bf = p._bifiltration
+        startends = [[[0, k0], [s0, 0]] for s0 in self._s0s for k0 in self._k0s]
+        startends += [[[0, k0], [np.inf, k0]] for k0 in self._k0s]
+        core_distances = bf._core_distances_of_lines(startends)
+        self.assertEqual(core_distances.shape, (self._n, len(startends)))
+        for l, (start, end) in enumerate(startends):
+            hc = bf.lambda_linkage(start, end)
+            np.testing.assert_almost_equal(core_distances[:, l], hc._heights)
+
+    def test_skew_core_distances_one_neighbor(self):
+        """ Check that the core distances with respect to a skew line are \
+            zero when there is a single neighbor """
+        core_distances, _ = lazy_intersections(
+            np.array([[0.1], [0.2]]), np.array([[0.5], [0.6]]), 10, 1, 1
+        )
+        np.testing.assert_array_equal(core_distances, [0, 0])
+        p = Persistable(self._X, n_neighbors=1)
+        core_distances = p._bifiltration._core_distances_of_lines([[[0, 0.5], [1, 0]]])
+        np.testing.assert_array_equal(core_distances, 0)
+
     def test_same_hierarchy(self):
         """ Check that lambda_linkage returns the same answer when using precomputed \
             distance, KDTree, BallTree, and Boruvka, Prim """
@@ -220,6 +265,85 @@ class TestDegreeRipsBifiltration(unittest.TestCase):
         np.testing.assert_almost_equal(ks, np.array(res_ks))
         np.testing.assert_almost_equal(hs, res)
 
+    def test_parallel_hilbert_function(self):
+        """Check that the Hilbert function computed by several workers, which \
+            send back the diagrams of chunks of lines, is the same as the one \
+            computed by a single one"""
+        X = make_blobs(n_samples=300, centers=3, random_state=0)[0]
+        for threading in [False, True]:
+            p = Persistable(X, n_neighbors=50, threading=threading)
+            _, _, hf, _ = p._hilbert_function(0, 3, 0.1, 0.01, 10)
+            _, _, hf_parallel, _ = p._hilbert_function(0, 3, 0.1, 0.01, 10, n_jobs=2)
+            np.testing.assert_array_equal(hf, hf_parallel)
+
+    def test_approximate_hilbert_function(self):
+        """Check that the Hilbert function computed with approximate single \
+            linkages is exact when the nearest neighbors contain the minimum \
+            spanning trees, and that approximate vineyards are not incremental"""
+        X = make_blobs(n_samples=300, centers=3, random_state=0)[0]
+        p = Persistable(X, n_neighbors=300)
+        _, _, hf, _ = p._hilbert_function(0, 3, 0.1, 0.01, 10)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            _, _, hf_approximate, _ = p._hilbert_function(
+                0, 3, 0.1, 0.01, 10, approximate=True
+            )
+        np.testing.assert_array_equal(hf, hf_approximate)
+        with self.assertRaises(ValueError):
+            p._linear_vineyard(
+                [[0, 0.1], [3, 0.01]],
+                [[0, 0.2], [3, 0.02]],
+                5,
+                incremental=True,
+                approximate=True,
+            )
+
+    def test_adaptive_hilbert_function(self):
+        """Check that the adaptive Hilbert function is exact on the lines of \
+            the coarse grid and close to the one on the regular grid for a few \
+            datasets"""
+        Xs = [
+            make_blobs(n_samples=500, centers=3, random_state=0)[0],
+            datasets.make_moons(n_samples=500, noise=0.1, random_state=0)[0],
+            datasets.make_circles(
+                n_samples=500, noise=0.05, factor=0.5, random_state=0
+            )[0],
+        ]
+        for X in Xs:
+            p = Persistable(X, n_neighbors=50)
+            max_s, max_k = p._find_end()
+            _, _, hf, _ = p._hilbert_function(0, max_s, max_k, 0, 65)
+            _, _, hf_adaptive, _ = p._hilbert_function(
+                0, max_s, max_k, 0, 65, adaptive_depth=3
+            )
+            np.testing.assert_array_equal(hf[:, ::8], hf_adaptive[:, ::8])
+            self.assertLess(np.mean(hf != hf_adaptive), 0.05)
+
+    def test_exact_hilbert_function(self):
+        """Check that the exact Hilbert function coincides with the one on a \
+            regular grid at the points of the grid"""
+        X = make_blobs(n_samples=300, centers=3, random_state=0)[0]
+        p = Persistable(X, n_neighbors=50)
+        ks, pds = p._hilbert_function_exact(0, 3, 0.1, 0.01)
+        self.assertEqual(len(ks), len(pds) + 1)
+        self.assertTrue(ks[0] <= ks[1] and np.all(np.diff(ks[1:]) > 0))
+        ss_grid, ks_grid, hf, _ = p._hilbert_function(0, 3, 0.1, 0.01, 30)
+        for j, k in enumerate(ks_grid):
+            pd = pds[max(0, np.searchsorted(ks, k) - 1)]
+            for i, s in enumerate(ss_grid[:-1]):
+                self.assertEqual(
+                    np.sum((pd[:, 0] <= s) & (s < pd[:, 1])), hf[i, j]
+                )
+
+    def test_exact_hilbert_function_many_lines(self):
+        """Check that a warning is given when the exact Hilbert function \
+            requires more lines than the threshold"""
+        X = make_blobs(n_samples=300, centers=3, random_state=0)[0]
+        p = Persistable(X, n_neighbors=50)
+        with mock.patch("persistable.persistable._MAX_EXACT_HILBERT_LINES", 10):
+            with self.assertWarns(UserWarning):
+                p._hilbert_function_exact(0, 3, 0.1, 0.01)
+
     def test_vertical_slice(self):
         """ Check that the persistence diagram of lambda_linkage is correct \
             for some vertical slices """
@@ -338,6 +462,91 @@ class TestDegreeRipsBifiltration(unittest.TestCase):
                         )
         np.testing.assert_almost_equal(ri, res)
 
+    def test_sparse_rank_invariant(self):
+        """Check that the rank decompositions computed from the sparse rank \
+            invariant coincide with the dense ones"""
+        X = make_blobs(n_samples=300, centers=3, random_state=0)[0]
+        p = Persistable(X, n_neighbors=50)
+        for reduced in [False, True]:
+            _, _, ri, rdr, rdh = p._bifiltration.rank_invariant_on_regular_grid(
+                0, 2, 0.1, 0.01, 7, reduced=reduced
+            )
+            _, _, _, rdr_sparse, rdh_sparse = (
+                p._bifiltration.rank_invariant_on_regular_grid(
+                    0, 2, 0.1, 0.01, 7, reduced=reduced, sparse=True
+                )
+            )
+            for dense, (indices, values) in [(rdr, rdr_sparse), (rdh, rdh_sparse)]:
+                self.assertTrue(np.all(values != 0))
+                res = np.zeros(ri.shape, dtype=np.int64)
+                res[tuple(indices.T)] = values
+                np.testing.assert_array_equal(dense, res)
+
+    def test_rank_invariant_diagonal(self):
+        """Check that the diagonal of the rank invariant is the Hilbert \
+            function for the uniform measure"""
+        for random_state in range(3):
+            X = make_blobs(n_samples=300, centers=3, random_state=random_state)[0]
+            p = Persistable(X, n_neighbors=50)
+            max_s, max_k = p._find_end()
+            for reduced in [False, True]:
+                _, _, hf, _ = p._hilbert_function(
+                    0, max_s, max_k, 0, 13, reduced=reduced
+                )
+                _, _, ri, _, _ = p._rank_invariant(
+                    0, max_s, max_k, 0, 13, reduced=reduced
+                )
+                i, j = np.meshgrid(range(13), range(13), indexing="ij")
+                np.testing.assert_array_equal(ri[i, j, i, j], hf)
+
+
+class TestAuxiliary(unittest.TestCase):
+    def test_searchsorted_rows(self):
+        """Check that searchsorted_rows agrees with np.searchsorted row by row"""
+        np.random.seed(0)
+        A = np.sort(np.random.randint(0, 10, size=(50, 20)).astype(float), axis=1)
+        for value in [-1, 0, 3, 3.5, 9, 10]:
+            for side in ["left", "right"]:
+                res = [np.searchsorted(row, value, side=side) for row in A]
+                np.testing.assert_array_equal(
+                    searchsorted_rows(A, value, side=side), res
+                )
+                np.testing.assert_array_equal(
+                    searchsorted_rows(A, value, side=side, n_threads=3), res
+                )
+
+    def test_kernel_threads(self):
+        """Check that the multithreaded kernels use a single thread inside \
+            the workers of parallel_computation"""
+        self.assertEqual(_kernel_threads(), cpu_count())
+        for threading in [False, True]:
+            n_threads = parallel_computation(
+                lambda _: _kernel_threads(), range(4), 2, threading=threading
+            )
+            self.assertEqual(n_threads, [1] * 4)
+
+    def test_kruskal(self):
+        """Check that kruskal returns a minimum spanning forest sorted by height"""
+        np.random.seed(0)
+        n = 100
+        # scipy adds up the weights of repeated edges, so edges are distinct
+        edges = np.array(np.triu_indices(n, k=1)).T
+        edges = edges[np.random.choice(edges.shape[0], 300, replace=False)]
+        weights = np.random.random_sample(300) + 1
+        order = np.argsort(weights)
+        merges, merges_heights = kruskal(
+            n,
+            np.ascontiguousarray(edges[order, 0], dtype=np.intp),
+            np.ascontiguousarray(edges[order, 1], dtype=np.intp),
+            weights[order],
+        )
+        mst = minimum_spanning_tree(
+            csr_matrix((weights, (edges[:, 0], edges[:, 1])), shape=(n, n))
+        )
+        self.assertEqual(merges.shape[0], mst.nnz)
+        self.assertTrue(np.all(np.diff(merges_heights) >= 0))
+        np.testing.assert_almost_equal(np.sum(merges_heights), mst.sum())
+
 
 class TestMetricSpace(unittest.TestCase):
     def test_subsampling(self):
@@ -358,6 +567,133 @@ class TestMetricSpace(unittest.TestCase):
     np.testing.assert_array_equal(reps, reps2)
 
 
+    def test_reused_boruvka(self):
+        """ Check that reusing a Boruvka algorithm for different core \
+            distances gives the same single linkage as a dense MST """
+        np.random.seed(0)
+        X = np.random.random_sample((50, 2))
+        ms1 = _MetricSpace(X, "minkowski", p=2)
+        ms1._fit_nn(10)
+        ms2 = _MetricSpace(distance_matrix(X, X), "precomputed")
+        for _ in range(3):
+            core_distances = np.random.random_sample(50) * 0.2
+            np.testing.assert_almost_equal(
+                ms1.generalized_single_linkage(core_distances)._merges_heights,
+                ms2.generalized_single_linkage(core_distances)._merges_heights,
+            )
+        self.assertEqual(len(ms1._boruvka_engines), 1)
+
+    def test_incremental_single_linkage(self):
+        """ Check that reusing the previous spanning tree for new core \
+            distances gives the same single linkage as computing it anew """
+        np.random.seed(0)
+        X = np.random.random_sample((500, 2))
+        for metric, kwargs in [("minkowski", {"p": 2}), ("seuclidean", {"V": np.ones(2)})]:
+            ms = _MetricSpace(X, metric, **kwargs)
+            ms._fit_nn(10)
+            single_linkage = _IncrementalSingleLinkage(ms)
+            core_distances = np.random.random_sample(500) * 0.2
+            for _ in range(4):
+                core_distances = core_distances.copy()
+                changed = np.random.choice(500, 10)
+                core_distances[changed] = np.random.random_sample(10) * 0.2
+                np.testing.assert_almost_equal(
+                    np.sort(single_linkage(core_distances)._merges_heights),
+                    np.sort(ms.generalized_single_linkage(core_distances)._merges_heights),
+                )
+
+    def test_approximate_single_linkage(self):
+        """ Check that the single linkage computed from the k-nearest \
+            neighbor graph is within the reported error bound of the exact one """
+        np.random.seed(0)
+        X = np.vstack(
+            [np.random.random_sample((300, 2)), np.random.random_sample((300, 2)) + 5]
+        )
+        ms = _MetricSpace(X, "minkowski", p=2)
+        ms._fit_nn(10)
+        core_distances = ms._nn_distance[:, 3]
+        hc, error_bound = ms.approximate_generalized_single_linkage(core_distances)
+        exact_heights = np.sort(
+            ms.generalized_single_linkage(core_distances)._merges_heights
+        )
+        approximate_heights = np.sort(hc._merges_heights)
+        self.assertEqual(approximate_heights.shape, exact_heights.shape)
+        self.assertTrue(np.all(approximate_heights >= exact_heights - 1e-10))
+        self.assertTrue(np.all(approximate_heights <= exact_heights + error_bound + 1e-10))
+
+    def test_streaming_rips_graph(self):
+        """ Check that the hierarchical clustering of a filtered Rips graph \
+            does not depend on the number of points queried at once """
+        np.random.seed(0)
+        X = np.random.random_sample((500, 2))
+        k_births = np.random.random_sample(500)
+        for ms in [
+            _MetricSpace(X, "minkowski", p=2),
+            _MetricSpace(distance_matrix(X, X), "precomputed"),
+        ]:
+            ms._fit_nn(10)
+            for rips_radius in [0.02, 0.1]:
+                hc1 = ms.hierarchical_clustering_filtered_rips_graph(
+                    k_births, rips_radius, chunk_size=None
+                )
+                hc2 = ms.hierarchical_clustering_filtered_rips_graph(
+                    k_births, rips_radius, chunk_size=37
+                )
+                np.testing.assert_almost_equal(
+                    hc1._merges_heights, hc2._merges_heights
+                )
+
+    def test_parallel_boruvka(self):
+        """ Check that the multithreaded Boruvka algorithm gives the same \
+            single linkage as the single threaded one """
+        np.random.seed(0)
+        X = np.random.random_sample((3000, 2))
+        for metric, kwargs in [("minkowski", {"p": 2}), ("seuclidean", {"V": np.ones(2)})]:
+            ms1 = _MetricSpace(X, metric, n_jobs=1, **kwargs)
+            ms1._fit_nn(10)
+            ms2 = _MetricSpace(X, metric, n_jobs=4, **kwargs)
+            ms2._fit_nn(10)
+            core_distances = ms1._nn_distance[:, 5].copy()
+            np.testing.assert_almost_equal(
+                ms1.generalized_single_linkage(core_distances)._merges_heights,
+                ms2.generalized_single_linkage(core_distances)._merges_heights,
+            )
+
+    def test_parallel_boruvka_mahalanobis(self):
+        """ Check that the multithreaded Boruvka algorithm gives the same \
+            single linkage as the single threaded one for a metric whose \
+            distance computations are not thread safe """
+        np.random.seed(0)
+        X = np.random.random_sample((3000, 3))
+        V = np.array([[1, 0.3, 0], [0.3, 1, 0.2], [0, 0.2, 1]])
+        ms1 = _MetricSpace(X, "mahalanobis", n_jobs=1, V=V)
+        ms1._fit_nn(10)
+        ms2 = _MetricSpace(X, "mahalanobis", n_jobs=4, V=V)
+        ms2._fit_nn(10)
+        core_distances = ms1._nn_distance[:, 5].copy()
+        np.testing.assert_array_equal(
+            ms1.generalized_single_linkage(core_distances)._merges_heights,
+            ms2.generalized_single_linkage(core_distances)._merges_heights,
+        )
+
+    def test_boruvka_in_parallel_workers(self):
+        """ Check that the Boruvka algorithms used by the workers of \
+            parallel_computation run in a single thread """
+        np.random.seed(0)
+        X = np.random.random_sample((1000, 2))
+        ms = _MetricSpace(X, "minkowski", n_jobs=4, p=2)
+        ms._fit_nn(10)
+        core_distances = ms._nn_distance[:, 5].copy()
+        parallel_computation(
+            lambda _: ms.generalized_single_linkage(core_distances),
+            range(4),
+            2,
+            threading=True,
+        )
+        self.assertTrue(len(ms._boruvka_engines) > 0)
+        self.assertTrue(all(n_jobs == 1 for n_jobs, _ in ms._boruvka_engines))
+
+
 class TestHierarchicalClustering(unittest.TestCase):
     def clustering_matrix(self, c):
         mat = np.full((c.shape[0], c.shape[0]), -1)
@@ -413,6 +749,28 @@ class TestHierarchicalClustering(unittest.TestCase):
             pd[np.lexsort(pd.T[::-1])], res[np.lexsort(res.T[::-1])]
         )
 
+    def test_persistence_diagrams(self):
+        """Check that the batched persistence diagrams coincide with the ones \
+            computed one at a time"""
+        np.random.seed(0)
+        hcs = []
+        for _ in range(50):
+            n = np.random.randint(1, 30)
+            m = np.random.randint(0, 2 * n)
+            heights = np.random.randint(0, 5, n)
+            merges = np.random.randint(0, n, (m, 2))
+            merges_heights = np.sort(np.random.randint(0, 6, m))
+            hcs.append(
+                _HierarchicalClustering(heights, merges, merges_heights, 0, 6)
+            )
+        for reduced in [False, True]:
+            pds = _persistence_diagrams(hcs, reduced=reduced, n_jobs=2)
+            self.assertEqual(len(pds), len(hcs))
+            for hc, pd in zip(hcs, pds):
+                np.testing.assert_array_equal(
+                    pd, hc.persistence_diagram(reduced=reduced).reshape(-1, 2)
+                )
+
     def test_flattening(self):
         """Check that persistence_based_flattening method returns correct answers"""
         heights = np.array([0, 1, 3, 8])
@@ -436,6 +794,44 @@ class TestHierarchicalClustering(unittest.TestCase):
             self.clustering_matrix(c), self.clustering_matrix(res)
         )
 
+    def test_condensed_tree_without_merges(self):
+        """Check that the condensed tree gives the same flattenings as the \
+            hierarchical clustering when there is a single point, or when \
+            there are no merges"""
+        hcs = [
+            _HierarchicalClustering([0], [], [], 0, 7),
+            _HierarchicalClustering([2, 0, 1], [], [], 0, 7),
+        ]
+        for hc in hcs:
+            condensed_tree = hc.condensed_tree()
+            for flattening_mode in ["conservative", "exhaustive"]:
+                for threshold in [0, 1, 10]:
+                    np.testing.assert_array_equal(
+                        condensed_tree.persistence_based_flattening(
+                            threshold, flattening_mode, False
+                        ),
+                        hc.persistence_based_flattening(
+                            threshold, flattening_mode, False
+                        ),
+                    )
+                for n_clusters in range(1, 4):
+                    np.testing.assert_array_equal(
+                        condensed_tree.persistence_based_flattening(
+                            condensed_tree._compute_threshold(n_clusters),
+                            flattening_mode,
+                            False,
+                        ),
+                        hc.persistence_based_flattening(
+                            hc._compute_threshold(n_clusters),
+                            flattening_mode,
+                            False,
+                        ),
+                    )
+        np.testing.assert_array_equal(
+            hcs[0].persistence_based_flattening(0, "conservative", False),
+            [0],
+        )
+
 
 class TestPersistable(unittest.TestCase):
     def test_number_clusters(self):
@@ -472,6 +868,61 @@ class TestPersistable(unittest.TestCase):
                 )
                 self.assertEqual(len(set(c[c >= 0])), i)
 
+    def test_clusterings(self):
+        """Check that clusterings returns the same labels as calling cluster
+        for each number of clusters"""
+        X, _ = datasets.make_blobs(
+            n_samples=500,
+            centers=4,
+            cluster_std=[0.05, 0.06, 0.07, 0.08],
+            random_state=0,
+        )
+        p = Persistable(X)
+        for flattening_mode in ["conservative", "exhaustive"]:
+            cs = p.clusterings(
+                n_clusters=range(1, 6),
+                start=[0, 0.05],
+                end=[0.3, 0],
+                flattening_mode=flattening_mode,
+            )
+            for i, c in zip(range(1, 6), cs):
+                np.testing.assert_array_equal(
+                    c,
+                    p.cluster(
+                        n_clusters=i,
+                        start=[0, 0.05],
+                        end=[0.3, 0],
+                        flattening_mode=flattening_mode,
+                    ),
+                )
+
+    def test_dbscan_clusters(self):
+        """Check that batched DBSCAN-style clusterings coincide with cutting a
+        horizontal linkage at each distance scale"""
+        X, _ = datasets.make_blobs(n_samples=300, centers=3, random_state=0)
+        p = Persistable(X, subsample=200)
+        xys = [(x, y) for y in [0.05, 0.1] for x in [2, 0.5, 1, 1]]
+        cs = p._dbscan_clusters(xys)
+        for (x, y), c in zip(xys, cs):
+            hc = p._bifiltration.lambda_linkage([0, y], [np.inf, y])
+            np.testing.assert_array_equal(c, p._labels_of_dataset(hc.cut(x)))
+        self.assertEqual(len(p._horizontal_linkages), 2)
+
+    def test_labels_file(self):
+        """Check that the labels written to a file coincide with the ones
+        returned in memory"""
+        X, _ = datasets.make_blobs(n_samples=300, centers=3, random_state=0)
+        p = Persistable(X, subsample=200)
+        c = p.cluster(n_clusters=3, start=[0, 0.1], end=[1, 0])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            labels_file = os.path.join(tmpdir, "labels.npy")
+            c_file = p.cluster(
+                n_clusters=3, start=[0, 0.1], end=[1, 0], labels_file=labels_file
+            )
+            np.testing.assert_array_equal(c, c_file)
+            np.testing.assert_array_equal(c, np.load(labels_file))
+            del c_file
+
 
 class TestVineyard(unittest.TestCase):
     def test_prominence_vineyard(self):
@@ -590,6 +1041,56 @@ class TestBettiNumbers(unittest.TestCase):
 
             np.testing.assert_equal(check, f)
 
+    def test_rectangles_to_hooks(self):
+        """Check that rank_decomposition_2d_rectangles_to_hooks and its sparse \
+            version return correct answers"""
+        np.random.seed(0)
+        a, b = 7, 5
+        rdr = np.random.randint(-2, 3, size=(a, b, a, b))
+        rdr[np.random.random_sample(rdr.shape) < 0.8] = 0
+        check = np.zeros(rdr.shape, dtype=np.int64)
+        for i in range(a):
+            for j in range(b):
+                for i_ in range(i, a):
+                    for j_ in range(j, b):
+                        up_i = min(i_ + 1, a - 1)
+                        up_j = min(j_ + 1, b - 1)
+                        check[i, j, up_i, up_j] -= rdr[i, j, i_, j_]
+                        check[i, j, up_i, j] += rdr[i, j, i_, j_]
+                        check[i, j, i, up_j] += rdr[i, j, i_, j_]
+        rdh = rank_decomposition_2d_rectangles_to_hooks(rdr.astype(np.int64))
+        np.testing.assert_equal(rdh, check)
+
+        indices = np.argwhere(rdr != 0)
+        rdh_indices, rdh_values = rank_decomposition_2d_rectangles_to_hooks_sparse(
+            indices, rdr[rdr != 0], rdr.shape
+        )
+        np.testing.assert_equal(rdh_indices, np.argwhere(check != 0))
+        np.testing.assert_equal(rdh_values, check[check != 0])
+
+    def test_slice_differences_of_boxes(self):
+        """Check that the slice differences computed from boxes coincide with \
+            the ones of the slice that is the sum of the boxes"""
+        np.random.seed(0)
+        shape = (6, 5, 7)
+        n_boxes = 40
+        a_starts = np.random.randint(0, 6, n_boxes)
+        a_ends = a_starts + np.random.randint(0, 4, n_boxes)
+        ks = np.random.randint(0, 5, n_boxes)
+        j_starts = np.random.randint(0, 7, n_boxes)
+        j_ends = j_starts + np.random.randint(0, 5, n_boxes)
+        ri_slice = np.zeros(shape, dtype=np.int64)
+        for a, a_, k, j, j_ in zip(a_starts, a_ends, ks, j_starts, j_ends):
+            ri_slice[a:a_, k, j:j_] += 1
+        indices, values = rank_invariant_slice_differences_of_boxes(
+            a_starts, a_ends, ks, j_starts, j_ends, shape
+        )
+        expected_indices, expected_values = rank_invariant_slice_differences(
+            ri_slice
+        )
+        np.testing.assert_equal(indices, expected_indices)
+        np.testing.assert_equal(values, expected_values)
+
 
 class TestFilteredGraph(unittest.TestCase):
     def clustering_matrix(self, c):
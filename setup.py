@@ -55,15 +55,37 @@ else:
     define_macros = []
 
 
+# Apple's clang does not ship with OpenMP, so we only compile the parallel
+# loops with OpenMP on the other platforms; elsewhere they run serially.
+if sys.platform.startswith("win"):
+    openmp_compile_args = ["/openmp"]
+    openmp_link_args = []
+elif sys.platform == "darwin":
+    openmp_compile_args = []
+    openmp_link_args = []
+else:
+    openmp_compile_args = ["-fopenmp"]
+    openmp_link_args = ["-fopenmp"]
+
+
 auxiliary = Extension(
     "persistable.auxiliary",
     sources=["persistable/auxiliary.pyx"],
     define_macros=define_macros,
+    extra_compile_args=openmp_compile_args,
+    extra_link_args=openmp_link_args,
 )
 persistence_diagram_h0 = Extension(
     "persistable.persistence_diagram_h0",
     sources=["persistable/persistence_diagram_h0.pyx"],
     define_macros=define_macros,
+    extra_compile_args=openmp_compile_args,
+    extra_link_args=openmp_link_args,
+)
+flattening = Extension(
+    "persistable.flattening",
+    sources=["persistable/flattening.pyx"],
+    define_macros=define_macros,
 )
 signed_betti_numbers = Extension(
     "persistable.signed_betti_numbers",
@@ -94,6 +116,8 @@ _hdbscan_boruvka = Extension(
     "persistable.borrowed._hdbscan_boruvka",
     sources=["persistable/borrowed/_hdbscan_boruvka.pyx"],
     define_macros=define_macros,
+    extra_compile_args=openmp_compile_args,
+    extra_link_args=openmp_link_args,
 )
 
 if not HAVE_CYTHON:
@@ -134,6 +158,7 @@ setup(
         signed_betti_numbers,
         auxiliary,
         persistence_diagram_h0,
+        flattening,
         subsampling,
         dense_mst,
         dist_metrics,